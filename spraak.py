@@ -2,9 +2,16 @@
 
 import speech_recognition as sr
 import datetime
+import time
 import math
 import os, sys, subprocess, webbrowser
+import shlex, shutil
 import json
+import re
+import hashlib
+import pickle
+import collections
+import heapq
 import cv2 
 import numpy as np
 import sounddevice as sd
@@ -12,6 +19,7 @@ import tkinter as tk
 from tkinter import ttk
 import threading
 import queue
+import random
 import paho.mqtt.client as mqtt
 import pyaudio
 
@@ -72,13 +80,18 @@ class Commando:
         raise NotImplementedError("moet worden overschreven!")
 
 # PC commando's uitvoeren (notepad, calculator, etc.)
+# Met een executor wordt de actie op de achtergrond gestart, de gui blokkeert niet
 class PcCommando(Commando):
-    def __init__(self, actie):
+    def __init__(self, actie, executor=None):
         self.actie = actie
+        self.executor = executor
         
     def uitvoering(self):
         tijd = datetime.datetime.now()
         print(f"PcCommando uitgevoerd op {tijd} met actie: {self.actie}")
+        if self.executor:
+            self.executor.submit(self.actie)
+            return
         try:
             os.system(self.actie)
         except Exception as e:
@@ -86,16 +99,415 @@ class PcCommando(Commando):
 
 # LED commando's via MQTT versturen
 class LedCommando(Commando):
-    def __init__(self, actie, mqtt_client=None):
+    def __init__(self, actie, mqtt_client=None, publisher=None, qos=1, categorie=None):
         self.actie = actie
         self.mqtt_client = mqtt_client
+        self.publisher = publisher # LedPublisher vóór de mqtt client (optioneel)
+        self.qos = qos # Uit het leveringsprofiel in led_commandos.json
+        self.categorie = categorie # Soort toestand (kleur, modus, ...), None voor een eenmalige actie
         
     def uitvoering(self):
         tijd = datetime.datetime.now()
         print(f"LedCommando uitgevoerd op {tijd} met actie: {self.actie}")
         
-        if self.mqtt_client:
-            self.mqtt_client.publish_command(self.actie)
+        if self.publisher: # Snel na elkaar gezegde commando's worden samengevoegd
+            self.publisher.submit(self.actie, self.qos, self.categorie)
+        elif self.mqtt_client:
+            self.mqtt_client.publish_command(self.actie, qos=self.qos, categorie=self.categorie)
+
+# ============================================================================
+# BUSINESS LOGIC - Configuratie
+# ============================================================================
+
+# Standaard instellingen van de applicatie (spraak_config.json)
+DEFAULT_SPRAAK_CONFIG = {
+    "recognizer": {
+        "backend": "google", # "google" (online) of "vosk" (offline)
+        "language": "nl-NL",
+        "vosk_model": "vosk-model-small-nl-0.22", # Map met het uitgepakte Vosk model
+        "grammar": True, # Lokale herkenning beperken tot de zinnen uit de commando catalogi
+        "streaming": True, # Tussentijdse resultaten gebruiken om commando's vroeg uit te voeren
+        "workers": 2, # Aantal parallelle herkenningen
+        "max_pending": 4 # Maximum aantal opgenomen zinnen in de wachtrij
+    },
+    "vad": {
+        "frame_ms": 20, # Lengte van een analyse frame (10-30 ms)
+        "energy_margin_db": 10.0, # Spraak moet zoveel dB boven de ruisvloer liggen
+        "max_flatness": 0.5, # Spectrale vlakheid boven deze waarde is ruis
+        "max_zcr": 0.5, # Zero-crossing rate boven deze waarde is ruis
+        "pause_threshold": 0.8, # Seconden stilte die een zin afsluiten (bovengrens bij adaptive)
+        "timeout": 3.0, # Seconden wachten op het begin van een zin
+        "phrase_time_limit": 5.0, # Maximale lengte van een zin in seconden
+        "adaptive": True, # Pauze en zinslengte leren uit herkende commando's
+        "min_pause": 0.3 # Kortste pauze die een zin afsluit
+    },
+    "matching": {
+        "fuzzy": True, # Bijna-juiste transcripties toch aan een commando koppelen
+        "fuzzy_threshold": 0.75 # Minimale score (0-1) voor een fuzzy match
+    },
+    "led": {
+        "coalesce_ms": 150, # Venster waarin snel opeenvolgende LED commando's samengevoegd worden
+        "batch": False, # Meerdere commando's in één bericht (als de controller dat ondersteunt)
+        "batch_separator": "," # Scheidingsteken tussen commando's in een batch bericht
+    },
+    "visualizer": {
+        "mode": "spectrum", # "spectrum" (frequentiebanden) of "level" (volume golf)
+        "frame_ms": 50, # Tijd tussen twee updates van de bars
+        "budget_ms": 4.0, # Maximale Tk tijd per update, overige bars volgen de volgende keer
+        "min_db": -70.0, # Niveau (dBFS) voor een lege bar in spectrum modus
+        "max_db": -10.0, # Niveau (dBFS) voor een volle bar in spectrum modus
+        "idle_after_s": 5.0, # Na zoveel seconden stilte trager updaten
+        "idle_frame_ms": 200 # Tijd tussen updates tijdens stilte (ook de maximale vertraging bij nieuw geluid)
+    },
+    "tracing": {
+        "enabled": True, # Vertraging per stap meten (einde spraak tot LED toestand)
+        "window": 500, # Aantal laatste metingen per stap voor p50/p95/p99
+        "export_file": "" # Rapport bij afsluiten, vb. "latency.json" ("" = niet wegschrijven)
+    }
+}
+
+# Laad applicatie instellingen uit spraak_config.json, ontbrekende waarden krijgen de standaard
+def load_spraak_config():
+    config = {sectie: dict(waarden) for sectie, waarden in DEFAULT_SPRAAK_CONFIG.items()}
+    
+    try:
+        with open("spraak_config.json", "r", encoding="utf-8") as f:
+            bestand = json.load(f)
+        
+        # Neem alleen gekende secties en sleutels van het juiste type over
+        for sectie, waarden in config.items():
+            ingelezen = bestand.get(sectie)
+            if not isinstance(ingelezen, dict):
+                continue
+            for key, standaard in waarden.items():
+                waarde = ingelezen.get(key)
+                if type(waarde) == type(standaard):
+                    waarden[key] = waarde
+                elif type(standaard) == float and type(waarde) == int: # 1 i.p.v. 1.0 toelaten
+                    waarden[key] = float(waarde)
+                    
+    except FileNotFoundError:
+        # Maak bestand aan met standaard configuratie
+        try:
+            with open("spraak_config.json", "w", encoding="utf-8") as f:
+                json.dump(DEFAULT_SPRAAK_CONFIG, f, indent=2)
+        except Exception as e:
+            pass
+    except json.JSONDecodeError as e:
+        pass
+    except Exception as e:
+        pass
+    
+    return config
+
+# Houdt configuratie bestanden in het oog en roept een callback aan bij wijziging
+# Draait in een eigen thread zodat herladen nooit de gui of de herkenning ophoudt
+class ConfigWatcher:
+    def __init__(self, interval=1.0):
+        self.interval = interval # Seconden tussen twee controles
+        self._watches = [] # [bestanden, callback, laatste (mtime, grootte)]
+        self._stop = threading.Event()
+        self._thread = None
+    
+    @staticmethod
+    def _stat(bestanden):
+        info = []
+        for bestand in bestanden:
+            try:
+                stat = os.stat(bestand)
+                info.append((stat.st_mtime_ns, stat.st_size))
+            except OSError:
+                info.append(None)
+        return tuple(info)
+    
+    def watch(self, bestanden, callback):
+        self._watches.append([tuple(bestanden), callback, self._stat(bestanden)])
+    
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="config-watcher", daemon=True)
+            self._thread.start()
+    
+    def stop(self):
+        self._stop.set()
+    
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            for watch in self._watches:
+                info = self._stat(watch[0])
+                if info != watch[2]:
+                    watch[2] = info
+                    try:
+                        watch[1]()
+                    except Exception as e:
+                        print(f"Fout bij herladen van {', '.join(watch[0])}: {e}")
+
+# ============================================================================
+# BUSINESS LOGIC - Latency Tracing
+# ============================================================================
+
+# Meet per ingesproken zin (trace id = zin_id) hoe lang elke stap duurt:
+# einde spraak -> endpoint -> recognize -> parse -> publish -> puback -> state (melding van de controller)
+# Elke stap telt vanaf de vorige stap die al gestempeld is; de laatste metingen per stap
+# worden bijgehouden voor p50/p95/p99. Het MQTT deel wordt gekoppeld via de commando tekst en de mid.
+class LatencyTracer:
+    STAPPEN = ("endpoint", "recognize", "parse", "publish", "puback", "state")
+    MAX_OPEN = 64 # Maximum aantal zinnen/commando's dat tegelijk gevolgd wordt
+    
+    def __init__(self, enabled=True, window=500):
+        self.enabled = enabled
+        self.metingen = {stap: collections.deque(maxlen=window) for stap in LatencyTracer.STAPPEN + ("totaal",)}
+        self.recent = collections.deque(maxlen=20) # Afgewerkte traces (ms per stap)
+        self._traces = collections.OrderedDict() # trace id -> {stap: tijdstip}
+        self._commandos = collections.OrderedDict() # commando op weg naar mqtt -> trace id
+        self._mids = collections.OrderedDict() # mid -> trace id (wacht op PUBACK)
+        self._toestanden = collections.OrderedDict() # verstuurd commando -> trace id (wacht op state)
+        self._vroege_acks = collections.OrderedDict() # PUBACK die binnenkwam voor publish() terugkeerde
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def nu(): # Monotone klok met hoge resolutie (time.monotonic is op Windows te grof)
+        return time.perf_counter()
+    
+    @staticmethod
+    def _bewaar(tabel, sleutel, waarde):
+        tabel.pop(sleutel, None)
+        tabel[sleutel] = waarde
+        while len(tabel) > LatencyTracer.MAX_OPEN:
+            tabel.popitem(last=False)
+    
+    # Zin afgesloten door de endpointer; spraak_einde: tijdstip van de laatste spraak (of None)
+    def begin(self, trace_id, spraak_einde=None):
+        if not self.enabled or trace_id is None:
+            return
+        with self._lock:
+            trace = self._traces.get(trace_id) # Bestaat al als het commando vroeg uitgevoerd werd
+            if trace is None:
+                trace = {}
+                self._bewaar(self._traces, trace_id, trace)
+            if spraak_einde is not None:
+                trace["spraak"] = spraak_einde
+        self.stamp(trace_id, "endpoint")
+    
+    def stamp(self, trace_id, stap, t=None):
+        if not self.enabled or trace_id is None:
+            return
+        t = self.nu() if t is None else t
+        with self._lock:
+            trace = self._traces.get(trace_id)
+            if trace is None: # Vb. commando op tussentijdse tekst, nog voor het einde van de zin
+                trace = {}
+                self._bewaar(self._traces, trace_id, trace)
+            if stap in trace:
+                return
+            
+            # Duur sinds de laatst gestempelde vorige stap
+            vorige = [trace[s] for s in ("spraak",) + LatencyTracer.STAPPEN[:LatencyTracer.STAPPEN.index(stap)]
+                      if s in trace and trace[s] <= t]
+            trace[stap] = t
+            if vorige:
+                self.metingen[stap].append(t - max(vorige))
+            
+            if stap == "state": # Laatste stap (een late PUBACK kan nog volgen)
+                begin = trace.get("spraak", min(trace.values()))
+                self.metingen["totaal"].append(t - begin)
+                stempels = sorted((tijd, s) for s, tijd in trace.items())
+                self.recent.append(dict(
+                    [("id", trace_id)] + [(s, round((tijd - begin) * 1000.0, 3)) for tijd, s in stempels]
+                ))
+    
+    # LED commando van deze zin wordt uitgevoerd (eventueel via de LedPublisher)
+    def expect(self, commando, trace_id):
+        if self.enabled and trace_id is not None:
+            with self._lock:
+                self._bewaar(self._commandos, commando, trace_id)
+    
+    # Batch bericht: de traces van de samengevoegde commando's volgen het batch bericht
+    def merge(self, commandos, samen):
+        if not self.enabled:
+            return
+        with self._lock:
+            for commando in commandos:
+                trace_id = self._commandos.pop(commando, None)
+                if trace_id is not None:
+                    self._bewaar(self._commandos, samen, trace_id)
+    
+    # Bericht verstuurd naar de broker
+    def published(self, commando, mid):
+        if not self.enabled:
+            return
+        with self._lock:
+            trace_id = self._commandos.pop(commando, None)
+            if trace_id is None:
+                return
+            self._bewaar(self._toestanden, commando, trace_id)
+            ack = self._vroege_acks.pop(mid, None)
+            if ack is None:
+                self._bewaar(self._mids, mid, trace_id)
+        self.stamp(trace_id, "publish")
+        if ack is not None:
+            self.stamp(trace_id, "puback", ack)
+    
+    def acked(self, mid):
+        if not self.enabled:
+            return
+        t = self.nu()
+        with self._lock:
+            trace_id = self._mids.pop(mid, None)
+            if trace_id is None:
+                self._bewaar(self._vroege_acks, mid, t)
+                return
+        self.stamp(trace_id, "puback", t)
+    
+    # Toestand gemeld door de controller
+    def state(self, commando):
+        if not self.enabled:
+            return
+        with self._lock:
+            trace_id = self._toestanden.pop(commando, None)
+        if trace_id is not None:
+            self.stamp(trace_id, "state")
+    
+    # p50/p95/p99 per stap in ms
+    def report(self):
+        stappen = {}
+        with self._lock:
+            for stap, waarden in self.metingen.items():
+                if not waarden:
+                    continue
+                ms = np.array(waarden) * 1000.0
+                stappen[stap] = {"n": len(ms)}
+                for p in (50, 95, 99):
+                    stappen[stap][f"p{p}"] = round(float(np.percentile(ms, p)), 3)
+            recent = list(self.recent)
+        return {"eenheid": "ms", "stappen": stappen, "recent": recent}
+    
+    def export(self, pad):
+        try:
+            with open(pad, "w", encoding="utf-8") as f:
+                json.dump(self.report(), f, indent=2)
+            return True
+        except Exception as e:
+            return False
+
+_latency_tracer = None
+
+def get_latency_tracer(): # Singleton LatencyTracer
+    global _latency_tracer
+    if _latency_tracer is None:
+        tracing = load_spraak_config()["tracing"]
+        _latency_tracer = LatencyTracer(tracing["enabled"], max(1, tracing["window"]))
+    return _latency_tracer
+
+# ============================================================================
+# BUSINESS LOGIC - Command Executor
+# ============================================================================
+
+# Start PC acties met subprocess op een worker thread i.p.v. os.system op de gui thread
+# Zonder shell als de actie een gewoon programma is, anders (vb. "start ...") via de shell.
+# Gestarte processen worden gevolgd, resultaten komen via result_callback(actie, ok, melding).
+class CommandExecutor:
+    SHELL_TEKENS = set("&|<>^%$`;()*?\"") # Actie heeft de shell nodig
+    OK_CODES = {"explorer": (0, 1)} # Programma's die ook bij succes een andere exit code geven
+
+    def __init__(self, startup_grace=2.0, poll_interval=0.5):
+        self.startup_grace = startup_grace # Proces dat zo lang blijft draaien is gestart
+        self.poll_interval = poll_interval # Hoe vaak lopende processen gecontroleerd worden
+        self.result_callback = None
+        self.processen = [] # (proces, actie, starttijd) binnen de startup_grace (enkel de worker thread)
+        self.jobs = queue.Queue()
+        self._closed = False
+        self._thread = threading.Thread(target=self._work, name="command-executor", daemon=True)
+        self._thread.start()
+
+    def submit(self, actie):
+        if not self._closed:
+            self.jobs.put(actie)
+
+    @property
+    def running(self): # Aantal processen dat nog in de startup_grace gevolgd wordt
+        return len(self.processen)
+
+    # Argumenten voor een directe start, of None als de shell nodig is
+    @staticmethod
+    def _argv(actie):
+        if CommandExecutor.SHELL_TEKENS & set(actie):
+            return None
+        try:
+            argv = shlex.split(actie, posix=(os.name != "nt"))
+        except ValueError:
+            return None
+        if not argv:
+            return None
+        programma = shutil.which(argv[0])
+        if programma is None: # Shell builtin (start, dir, ...) of onbekend
+            return None
+        if os.name == "nt" and programma.lower().endswith((".bat", ".cmd")): # vb. code.cmd
+            return None
+        return [programma] + argv[1:]
+
+    def _start(self, actie):
+        argv = self._argv(actie)
+        opties = {"stdin": subprocess.DEVNULL, "stdout": subprocess.DEVNULL, "stderr": subprocess.DEVNULL}
+        if os.name == "nt":
+            opties["creationflags"] = getattr(subprocess, "CREATE_NO_WINDOW", 0) if argv is None else 0
+        else:
+            opties["start_new_session"] = True # Blijft draaien als de app sluit
+        
+        if argv is not None:
+            return subprocess.Popen(argv, **opties)
+        return subprocess.Popen(actie, shell=True, **opties)
+
+    def _report(self, actie, ok, melding):
+        print(f"Actie '{actie}': {melding}")
+        if self.result_callback:
+            try:
+                self.result_callback(actie, ok, melding)
+            except Exception as e:
+                pass
+
+    # Resultaat melden van processen die afliepen of de startup_grace haalden
+    # Daarna niet meer volgen: een open programma (notepad, spotify) houdt de worker niet wakker.
+    # Op POSIX ruimt subprocess een later afgesloten proces zelf op bij de volgende Popen.
+    def _reap(self):
+        nu = time.monotonic()
+        lopend = []
+        for item in self.processen:
+            proces, actie, start = item
+            code = proces.poll()
+            if code is None:
+                if nu - start >= self.startup_grace:
+                    self._report(actie, True, "gestart")
+                else:
+                    lopend.append(item)
+            elif code not in CommandExecutor.OK_CODES.get(actie.split()[0].lower(), (0,)):
+                self._report(actie, False, f"afgesloten met code {code}")
+            else:
+                self._report(actie, True, "uitgevoerd")
+        self.processen = lopend
+
+    def _work(self):
+        while True:
+            try:
+                actie = self.jobs.get(timeout=self.poll_interval if self.processen else None)
+            except queue.Empty:
+                actie = None
+            else:
+                if actie is None: # close()
+                    return
+            
+            if actie is not None:
+                try:
+                    proces = self._start(actie)
+                    self.processen.append((proces, actie, time.monotonic()))
+                except Exception as e:
+                    self._report(actie, False, f"kon niet starten: {e}")
+            self._reap()
+
+    # Gestarte programma's blijven open, enkel de worker stopt
+    def close(self):
+        self._closed = True
+        self.jobs.put(None)
 
 # ============================================================================
 # BUSINESS LOGIC - MQTT Client
@@ -106,7 +518,15 @@ def load_mqtt_config():
     default_config = { # Standaard instellingen indien bestand ontbreekt of onjuist is
         "broker": "localhost",
         "port": 1883,
-        "topic": "led/commands"
+        "command_topic": "led/commands", # Hier publiceren we de commando's
+        "state_topic": "led/state", # Retained toestand die de controller zelf meldt
+        "outbox_size": 100, # Maximum aantal commando's dat wacht op een verbinding
+        "outbox_file": "", # Append-only bestand voor de wachtrij (leeg = enkel in geheugen)
+        "outbox_max_age": 300, # Seconden waarna een wachtend commando vervalt
+        "replay": "latest", # "latest": enkel laatste LED toestand per soort, "all": alles in volgorde
+        "mqtt_version": "3.1.1", # "3.1.1" of "5"
+        "message_expiry": 0, # MQTT 5: seconden waarna de broker een commando niet meer aflevert (0 = nooit)
+        "topic_alias": True # MQTT 5: topic alias gebruiken (kortere berichten)
     }
     
     try:
@@ -120,8 +540,34 @@ def load_mqtt_config():
             if not isinstance(config.get("port"), int) or not (1 <= config.get("port", 0) <= 65535):
                 config["port"] = default_config["port"]
             
-            if not isinstance(config.get("topic"), str) or not config.get("topic"):
-                config["topic"] = default_config["topic"]
+            if not isinstance(config.get("command_topic"), str) or not config.get("command_topic"):
+                # Oudere config met één "topic" blijft werken als commando topic
+                oud = config.get("topic")
+                config["command_topic"] = oud if isinstance(oud, str) and oud else default_config["command_topic"]
+            
+            if not isinstance(config.get("state_topic"), str) or not config.get("state_topic"):
+                config["state_topic"] = default_config["state_topic"]
+            
+            if not isinstance(config.get("outbox_size"), int) or config.get("outbox_size") < 1:
+                config["outbox_size"] = default_config["outbox_size"]
+            
+            if not isinstance(config.get("outbox_file"), str):
+                config["outbox_file"] = default_config["outbox_file"]
+            
+            if not isinstance(config.get("outbox_max_age"), (int, float)) or config.get("outbox_max_age") <= 0:
+                config["outbox_max_age"] = default_config["outbox_max_age"]
+            
+            if config.get("replay") not in ("latest", "all"):
+                config["replay"] = default_config["replay"]
+            
+            if config.get("mqtt_version") not in ("3.1.1", "5"):
+                config["mqtt_version"] = default_config["mqtt_version"]
+            
+            if not isinstance(config.get("message_expiry"), int) or config.get("message_expiry") < 0:
+                config["message_expiry"] = default_config["message_expiry"]
+            
+            if not isinstance(config.get("topic_alias"), bool):
+                config["topic_alias"] = default_config["topic_alias"]
             
             return config
             
@@ -139,149 +585,1234 @@ def load_mqtt_config():
     except Exception as e:
         return default_config
 
+# Standaard categorie voor led_commandos.json zonder "categorie", gezocht op de actie of een woord uit
+# haar zinnen; commando's van dezelfde categorie vervangen elkaar (samenvoegen, outbox replay "latest")
+LED_CATEGORIEEN = {
+    "rood": "kleur", "blauw": "kleur", "groen": "kleur", "geel": "kleur",
+    "paars": "kleur", "oranje": "kleur", "roze": "kleur", "wit": "kleur",
+    "regenboog": "modus", "termodus": "modus", "knipperen": "modus",
+    "aan": "power", "uit": "power",
+}
+
+# Leveringsprofielen voor led_commandos.json ({"actie": "...", "profiel": "..."} of "qos")
+# Toestanden zijn idempotent (fire-and-forget), eenmalige acties moeten aankomen
+LEVERINGSPROFIELEN = {"state": 0, "action": 1, "critical": 2}
+
+def standaard_qos(categorie):
+    return LEVERINGSPROFIELEN["state"] if categorie else LEVERINGSPROFIELEN["action"]
+
+# Wachtrij voor commando's die niet verstuurd konden worden (geen verbinding)
+# Begrensd in geheugen, optioneel ook append-only naar een bestand zodat een herstart niets verliest.
+# add() blokkeert nooit: bij een volle wachtrij valt het oudste commando weg (en wordt geteld).
+class MqttOutbox:
+    def __init__(self, max_items=100, bestand="", max_age=300, replay="latest"):
+        self.max_items = max_items
+        self.bestand = bestand
+        self.max_age = max_age # Seconden, oudere commando's worden niet meer afgespeeld
+        self.replay = replay
+        self.items = collections.deque() # (volgnummer, tijdstip (epoch), commando, qos, categorie)
+        self.volgnummer = 0
+        self.metrics = {
+            "queued": 0, # In de wachtrij gezet
+            "replayed": 0, # Na een reconnect verstuurd
+            "superseded": 0, # Vervangen door een latere LED toestand van dezelfde soort
+            "expired": 0, # Te oud bij het afspelen
+            "overflow": 0, # Weggevallen omdat de wachtrij vol zat
+            "high_water": 0 # Grootste lengte van de wachtrij
+        }
+        self._regels = 0 # Regels in het bestand, herschrijven als het veel groter is dan de wachtrij
+        self._lock = threading.Lock()
+        self._laad_bestand()
+    
+    def __len__(self):
+        return len(self.items)
+    
+    def _laad_bestand(self): # Wachtrij van een vorige sessie terugzetten
+        if not self.bestand:
+            return
+        try:
+            with open(self.bestand, "r", encoding="utf-8") as f:
+                for regel in f:
+                    try:
+                        item = json.loads(regel)
+                        self._toevoegen(item["t"], item["commando"], item.get("qos", 1), item.get("categorie"))
+                        self._regels += 1
+                    except (ValueError, KeyError, TypeError) as e:
+                        pass # Half geschreven laatste regel
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"Outbox bestand niet gelezen: {e}")
+    
+    def _toevoegen(self, tijdstip, commando, qos, categorie):
+        if len(self.items) >= self.max_items:
+            self.items.popleft()
+            self.metrics["overflow"] += 1
+        self.volgnummer += 1
+        self.items.append((self.volgnummer, tijdstip, commando, qos, categorie))
+        self.metrics["high_water"] = max(self.metrics["high_water"], len(self.items))
+    
+    def add(self, commando, qos=1, categorie=None):
+        with self._lock:
+            tijdstip = time.time()
+            self._toevoegen(tijdstip, commando, qos, categorie)
+            self.metrics["queued"] += 1
+            if self.bestand:
+                try:
+                    if self._regels >= 2 * self.max_items: # Weggevallen commando's uit het bestand halen
+                        self._herschrijf()
+                    else:
+                        with open(self.bestand, "a", encoding="utf-8") as f:
+                            f.write(json.dumps({"t": tijdstip, "commando": commando, "qos": qos, "categorie": categorie}, ensure_ascii=False) + "\n")
+                        self._regels += 1
+                except Exception as e:
+                    pass
+            return len(self.items)
+    
+    # Gewijzigde instellingen uit mqtt_config.json toepassen (zonder herstart)
+    def configure(self, max_items, bestand, max_age, replay):
+        with self._lock:
+            self.max_items, self.max_age, self.replay = max_items, max_age, replay
+            while len(self.items) > self.max_items: # Kleinere wachtrij: oudste vallen weg
+                self.items.popleft()
+                self.metrics["overflow"] += 1
+            if bestand != self.bestand:
+                self.bestand = bestand
+                if bestand: # Huidige wachtrij meteen in het nieuwe bestand
+                    try:
+                        self._herschrijf()
+                    except Exception as e:
+                        print(f"Outbox bestand niet geschreven: {e}")
+    
+    def _herschrijf(self): # Bestand = huidige wachtrij (via tijdelijk bestand, nooit half)
+        tijdelijk = self.bestand + ".tmp"
+        with open(tijdelijk, "w", encoding="utf-8") as f:
+            for volgnummer, tijdstip, commando, qos, categorie in self.items:
+                f.write(json.dumps({"t": tijdstip, "commando": commando, "qos": qos, "categorie": categorie}, ensure_ascii=False) + "\n")
+        os.replace(tijdelijk, self.bestand)
+        self._regels = len(self.items)
+    
+    # Alles wat afgespeeld moet worden als (commando, qos, categorie), in volgorde, en de wachtrij leegmaken
+    # "latest": per LED categorie enkel het laatste, eenmalige acties allemaal
+    def drain(self):
+        with self._lock:
+            items = list(self.items)
+            self.items.clear()
+            if self.bestand:
+                try:
+                    open(self.bestand, "w", encoding="utf-8").close()
+                    self._regels = 0
+                except Exception as e:
+                    pass
+        
+        grens = time.time() - self.max_age
+        vers = [item for item in items if item[1] >= grens]
+        self.metrics["expired"] += len(items) - len(vers)
+        
+        if self.replay == "latest":
+            laatste = {} # categorie -> volgnummer van het laatste commando
+            for volgnummer, tijdstip, commando, qos, categorie in vers:
+                if categorie:
+                    laatste[categorie] = volgnummer
+            behouden = [item for item in vers if not item[4] or laatste[item[4]] == item[0]]
+            self.metrics["superseded"] += len(vers) - len(behouden)
+            vers = behouden
+        
+        self.metrics["replayed"] += len(vers)
+        return [(commando, qos, categorie) for volgnummer, tijdstip, commando, qos, categorie in vers]
+
+# paho-mqtt 2.x vraagt een callback API versie, 1.x kent die parameter niet
+# VERSION1 houdt de callback signaturen van 1.x zodat beide versies werken
+# (met MQTT 5 krijgen de callbacks een extra properties argument)
+def maak_paho_client(**opties):
+    if hasattr(mqtt, "CallbackAPIVersion"):
+        return mqtt.Client(mqtt.CallbackAPIVersion.VERSION1, **opties)
+    return mqtt.Client(**opties)
+
 # MQTT client met automatische reconnect en status feedback
+# Verbinden en de netwerk loop draaien in een eigen supervisor thread: de gui wacht nooit
+# op de broker en na een verbroken verbinding wordt zonder limiet opnieuw geprobeerd
 class MqttClient:
-    def __init__(self, broker=None, port=None, topic=None, status_callback=None):
+    RECONNECT_MIN = 0.5 # Seconden wachten na de eerste mislukte poging
+    RECONNECT_MAX = 30.0 # Maximale wachttijd tussen pogingen
+
+    ECHO_VENSTER = 2.0 # Seconden waarin een bericht gelijk aan een eigen commando als echo geldt
+
+    def __init__(self, broker=None, port=None, command_topic=None, state_topic=None, status_callback=None):
         config = load_mqtt_config()
         self.broker = broker or config.get("broker")
         self.port = port or config.get("port")
-        self.topic = topic or config.get("topic")
-        self.client = mqtt.Client()
+        self.command_topic = command_topic or config.get("command_topic")
+        self.state_topic = state_topic or config.get("state_topic")
+        self._verzonden = collections.deque(maxlen=32) # (commando, tijd) voor echo filtering
+        self.v5 = config.get("mqtt_version") == "5"
+        self.message_expiry = config.get("message_expiry", 0)
+        self.topic_alias = config.get("topic_alias", True)
+        self._alias_max = 0 # Topic alias maximum uit de CONNACK van de broker
+        self._aliassen = {} # topic -> alias, geldig voor één verbinding
+        self.client = self._maak_client()
         self.connected = False
         self.message_callback = None
         self.status_callback = status_callback
-        self.reconnect_attempts = 0
-        self.max_reconnect_attempts = 5
+        self.laatste_status = (False, "Verbinden...") # Voor een status_callback die later gezet wordt
+        self.laatste_toestand = None # Laatste toestand van de controller (vb. retained bij het subscriben)
+        # connected controleren + in de outbox zetten gebeurt atomisch met verbinden + afspelen,
+        # zo blijft geen commando in de outbox hangen en gaat niets nieuws vóór de oudere commando's
+        self._outbox_lock = threading.RLock()
+        self.reconnect_attempts = 0 # Mislukte pogingen sinds de laatste verbinding
+        self._socket_open = False
+        self._stop = threading.Event()
+        self._wakker = threading.Event() # Onderbreekt het wachten (nieuwe broker, afsluiten)
+        self._thread = None
+        self.outbox = MqttOutbox( # Commando's zonder verbinding, afgespeeld bij (re)connect
+            config.get("outbox_size", 100),
+            config.get("outbox_file", ""),
+            config.get("outbox_max_age", 300),
+            config.get("replay", "latest")
+        )
         
         # Valideer configuratie
-        if not self.broker or not self.port or not self.topic:
+        if not self.broker or not self.port or not self.command_topic or not self.state_topic:
             raise ValueError("MQTT configuratie onvolledig")
         
-        # Callbacks
-        self.client.on_connect = self._on_connect
-        self.client.on_disconnect = self._on_disconnect
-        self.client.on_publish = self._on_publish
-        self.client.on_message = self._on_message
-        
-        # Probeer verbinding te maken
+        # Verbinden op de achtergrond
         self.connect()
     
-    def _on_connect(self, client, userdata, flags, rc):
+    # paho client, of de in-process loopback broker (tests en benchmarks)
+    def _maak_client(self):
+        if self.broker == LOOPBACK_BROKER:
+            client = LoopbackClient(get_loopback_broker())
+        else:
+            client = maak_paho_client(protocol=mqtt.MQTTv5 if self.v5 else mqtt.MQTTv311)
+        
+        # Callbacks
+        client.on_connect = self._on_connect
+        client.on_disconnect = self._on_disconnect
+        client.on_publish = self._on_publish
+        client.on_message = self._on_message
+        return client
+    
+    def _status(self, connected, tekst):
+        self.laatste_status = (connected, tekst) # Eerst bewaren, dan pas de callback lezen
+        callback = self.status_callback
+        if callback:
+            callback(connected, tekst)
+    
+    # De supervisor kan al verbonden zijn voor de gui bestaat: meld meteen de huidige status
+    def set_status_callback(self, callback):
+        self.status_callback = callback
+        if callback:
+            callback(*self.laatste_status)
+    
+    def _on_connect(self, client, userdata, flags, rc, *rest):
         if rc == 0:
-            self.connected = True
             self.reconnect_attempts = 0
-            self.client.subscribe(self.topic)
+            self._aliassen = {}
+            self._alias_max = getattr(rest[0], "TopicAliasMaximum", 0) if self.v5 and rest and rest[0] else 0
+            self._subscribe_state()
             
-            if self.status_callback:
-                self.status_callback(True, "Verbonden") #aanduiding van succesvolle verbinding
+            with self._outbox_lock:
+                self.connected = True
+                self._status(True, "Verbonden") #aanduiding van succesvolle verbinding
+                self._replay_outbox()
         else:
             self.connected = False
-            if self.status_callback:
-                self.status_callback(False, f"Fout: {rc}") #aanduiding van verbindingsfout
+            self._status(False, f"Fout: {rc}") #aanduiding van verbindingsfout
     
-    def _on_disconnect(self, client, userdata, rc):
+    def _on_disconnect(self, client, userdata, rc, *rest):
         self.connected = False
-        
-        if self.status_callback:
-            self.status_callback(False, "Verbinding verbroken")
-        
-        # Automatisch opnieuw verbinden (max 5 pogingen)
-        if rc != 0 and self.reconnect_attempts < self.max_reconnect_attempts:
-            self.reconnect_attempts += 1
-            try:
-                self.client.reconnect()
-            except Exception as e:
-                pass
+        self._status(False, "Verbinding verbroken") # Opnieuw verbinden doet de supervisor
     
-    def _on_publish(self, client, userdata, mid):
-        pass
+    def _on_publish(self, client, userdata, mid, *rest): # PUBACK (QoS 0: bericht verstuurd)
+        get_latency_tracer().acked(mid)
+    
+    # Nooit het commando topic: geen eigen echo. MQTT 5 filtert ook bij één gedeeld topic (no_local).
+    def _subscribe_state(self):
+        if self.v5:
+            from paho.mqtt.subscribeoptions import SubscribeOptions
+            self.client.subscribe(self.state_topic, options=SubscribeOptions(qos=1, noLocal=True))
+        else:
+            self.client.subscribe(self.state_topic)
+    
+    # Controller met één topic voor commando's en toestand: eigen berichten herkennen (MQTT 3.1.1)
+    def _is_echo(self, command):
+        if self.v5 or self.state_topic != self.command_topic:
+            return False
+        grens = time.monotonic() - MqttClient.ECHO_VENSTER
+        for item in list(self._verzonden): # Kopie: publish_command voegt toe vanuit een andere thread
+            if item[0] == command and item[1] >= grens:
+                try:
+                    self._verzonden.remove(item)
+                except ValueError:
+                    pass
+                return True
+        return False
     
     def _on_message(self, client, userdata, msg):
         try:
             command = msg.payload.decode('utf-8') #decoderen van ontvangen bericht
+            if self._is_echo(command):
+                return
+            get_latency_tracer().state(command)
             print(f"MQTT ontvangen: '{command}'") #tonen van ontvangen bericht
             
-            if self.message_callback:
-                self.message_callback(command)
+            self.laatste_toestand = command # Eerst bewaren, dan pas de callback lezen
+            callback = self.message_callback
+            if callback:
+                callback(command)
         except Exception as e:
             pass
     
+    # De retained toestand kan al binnen zijn voor de gui bestaat: meteen doorgeven
     def set_message_callback(self, callback):
         self.message_callback = callback
+        toestand = self.laatste_toestand
+        if callback and toestand is not None:
+            callback(toestand)
     
+    # Start de supervisor (keert meteen terug), de status volgt via status_callback
     def connect(self):
-        try:
-            self.client.connect(self.broker, self.port, keepalive=60)
-            self.client.loop_start()
+        if self._thread is not None and self._thread.is_alive():
             return True
-        except Exception as e:
-            self.connected = False
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._supervise, name="mqtt-supervisor", daemon=True)
+        self._thread.start()
+        return True
+    
+    # Exponentieel oplopend met jitter, zodat clients niet tegelijk de broker bestoken
+    def _backoff(self):
+        self.reconnect_attempts += 1
+        stappen = min(self.reconnect_attempts - 1, 16) # Exponent begrenzen: geen overloop na uren zonder broker
+        maximum = min(MqttClient.RECONNECT_MAX, MqttClient.RECONNECT_MIN * 2 ** stappen)
+        return maximum / 2 + random.uniform(0, maximum / 2)
+    
+    def _wacht_opnieuw(self, reden):
+        wacht = self._backoff()
+        self._status(False, f"{reden}, opnieuw over {wacht:.1f}s")
+        self._wakker.wait(wacht)
+    
+    def _supervise(self):
+        self._status(False, "Verbinden...")
+        while not self._stop.is_set():
+            try:
+                if not self._socket_open:
+                    self._wakker.clear()
+                    try:
+                        self.client.connect(self.broker, self.port, keepalive=60)
+                        self._socket_open = True
+                    except Exception as e:
+                        self._wacht_opnieuw("Geen verbinding")
+                        continue
+                
+                # Netwerk verkeer (ook de CONNACK) en keepalive
+                if self.client.loop(timeout=1.0) != mqtt.MQTT_ERR_SUCCESS:
+                    self._socket_open = False
+                    self.connected = False
+                    if not self._stop.is_set():
+                        self._wacht_opnieuw("Verbinding verbroken")
+            except Exception as e: # Geen enkele fout mag het opnieuw verbinden voorgoed stoppen
+                print(f"MQTT supervisor fout: {e}")
+                self._socket_open = False
+                self.connected = False
+                if not self._stop.is_set():
+                    try:
+                        self._wacht_opnieuw("Fout")
+                    except Exception as e:
+                        self._wakker.wait(MqttClient.RECONNECT_MAX)
+        
+        self._socket_open = False
+        self.connected = False
+    
+    # Pas gewijzigde mqtt_config.json toe zonder herstart
+    # Enkel opnieuw verbinden als broker, poort of MQTT versie veranderd zijn
+    def reload_config(self):
+        try:
+            with open("mqtt_config.json", "r", encoding="utf-8") as f:
+                json.load(f) # Half opgeslagen bestand: huidige instellingen houden
+        except (OSError, json.JSONDecodeError) as e:
             return False
+        
+        config = load_mqtt_config()
+        self.command_topic = config["command_topic"]
+        self.message_expiry = config.get("message_expiry", 0)
+        self.topic_alias = config.get("topic_alias", True)
+        self.outbox.configure(
+            config.get("outbox_size", 100),
+            config.get("outbox_file", ""),
+            config.get("outbox_max_age", 300),
+            config.get("replay", "latest")
+        )
+        if config["state_topic"] != self.state_topic:
+            oud_topic, self.state_topic = self.state_topic, config["state_topic"]
+            if self.connected:
+                self.client.unsubscribe(oud_topic)
+                self._subscribe_state()
+        
+        v5 = config.get("mqtt_version") == "5"
+        if (config["broker"], config["port"]) != (self.broker, self.port) or v5 != self.v5:
+            wissel = (config["broker"] == LOOPBACK_BROKER) != (self.broker == LOOPBACK_BROKER) or v5 != self.v5
+            self.broker, self.port, self.v5 = config["broker"], config["port"], v5
+            print(f"MQTT broker gewijzigd: {self.broker}:{self.port} (MQTT {'5' if v5 else '3.1.1'})")
+            # Supervisor verbindt meteen opnieuw met de nieuwe broker
+            self.reconnect_attempts = 0
+            oude_client = self.client
+            if wissel: # Van of naar de loopback broker, of andere MQTT versie: nieuwe client
+                self.client = self._maak_client()
+            try:
+                oude_client.disconnect()
+            except Exception as e:
+                pass
+            self._wakker.set()
+            return True
+        return False
+    
+    # MQTT 5 publish properties: vervaltijd en topic alias (enkel QoS 0 zonder topic,
+    # QoS 1/2 kan na een reconnect opnieuw verstuurd worden en houdt daarom het topic)
+    def _publish_opties(self, topic, qos):
+        if not self.v5:
+            return topic, None
+        from paho.mqtt.properties import Properties
+        from paho.mqtt.packettypes import PacketTypes
+        
+        properties = Properties(PacketTypes.PUBLISH)
+        if self.message_expiry:
+            properties.MessageExpiryInterval = self.message_expiry
+        if self.topic_alias and self._alias_max:
+            alias = self._aliassen.get(topic)
+            if alias is None and len(self._aliassen) < self._alias_max:
+                alias = self._aliassen[topic] = len(self._aliassen) + 1
+                properties.TopicAlias = alias # Eerste keer: topic + alias registreren
+            elif alias is not None:
+                properties.TopicAlias = alias
+                if qos == 0:
+                    topic = ""
+        return topic, properties
     
     # Verstuur LED commando naar MQTT broker
-    def publish_command(self, command):
+    # Zonder verbinding gaat het commando naar de outbox (blokkeert nooit), geeft dan False
+    # qos: 0 voor toestanden (geen PUBACK wachten), 1/2 voor eenmalige acties
+    # categorie: voor de outbox (replay "latest" houdt per categorie enkel het laatste)
+    def publish_command(self, command, qos=1, categorie=None):
         if not command or not isinstance(command, str):
             return False
-            
+        
+        with self._outbox_lock:
+            return self._publish(command, qos, categorie)
+    
+    def _publish(self, command, qos, categorie):
         if not self.connected:
-            if self.status_callback:
-                self.status_callback(False, "Niet verbonden")
+            self._queue(command, qos, categorie)
             return False
             
         try:
-            result = self.client.publish(self.topic, command, qos=1) #verzenden van mqtt bericht
+            topic, properties = self._publish_opties(self.command_topic, qos)
+            # Vóór het versturen onthouden: de echo kan binnenkomen voor publish() terugkeert
+            verzonden = (command, time.monotonic())
+            self._verzonden.append(verzonden)
+            result = self.client.publish(topic, command, qos=qos, properties=properties) #verzenden van mqtt bericht
+            if result.rc != mqtt.MQTT_ERR_SUCCESS and verzonden in self._verzonden:
+                self._verzonden.remove(verzonden)
             if result.rc == mqtt.MQTT_ERR_SUCCESS:
-                print(f"MQTT: '{command}' → {self.topic}") #tonen van verzonden bericht
+                get_latency_tracer().published(command, result.mid)
+                print(f"MQTT: '{command}' → {self.command_topic} (qos {qos})") #tonen van verzonden bericht
                 return True
-            else:
-                return False
+            elif result.rc == mqtt.MQTT_ERR_NO_CONN: # Verbinding net weggevallen
+                self._queue(command, qos, categorie)
+            return False
         except Exception as e:
             return False
     
+    def _queue(self, command, qos=1, categorie=None):
+        aantal = self.outbox.add(command, qos, categorie)
+        self._status(False, f"Niet verbonden ({aantal} in wachtrij)")
+    
+    def _replay_outbox(self): # Na (re)connect: wachtende commando's volgens de replay policy
+        commandos = self.outbox.drain()
+        for command, qos, categorie in commandos:
+            self.publish_command(command, qos, categorie)
+        if commandos:
+            print(f"MQTT outbox afgespeeld: {len(commandos)} commando('s), {self.outbox.metrics}")
+    
     def disconnect(self):
+        self._stop.set()
+        self._wakker.set()
         try:
-            self.client.loop_stop()
             self.client.disconnect()
         except Exception as e:
             pass
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=2.0)
+
+# Publisher vóór MqttClient.publish_command die bursts samenvoegt
+# Het eerste commando gaat meteen weg, wat binnen coalesce_ms volgt wordt verzameld:
+# per categorie blijft enkel het laatste over ("rood... nee blauw" -> enkel blauw)
+class LedPublisher:
+    def __init__(self, mqtt_client, coalesce_ms=150, batch=False, batch_separator=","):
+        self.mqtt_client = mqtt_client
+        self.window = coalesce_ms / 1000.0
+        self.batch = batch
+        self.batch_separator = batch_separator
+        self.pending = collections.OrderedDict() # categorie (of volgnummer) -> (actie, qos, categorie), oudste eerst
+        self.dropped = 0 # Aantal weggelaten (vervangen) commando's
+        self._laatste_verzending = -math.inf
+        self._volgnummer = 0
+        self._timer = None
+        self._lock = threading.Lock()
+
+    # categorie: uit led_commandos.json, None voor een eenmalige actie
+    def submit(self, actie, qos=1, categorie=None):
+        with self._lock:
+            nu = time.monotonic()
+            if not self.pending and nu - self._laatste_verzending >= self.window:
+                self._laatste_verzending = nu # Rustig: meteen versturen, venster start nu
+                verzenden = [(actie, qos, categorie)]
+            else:
+                sleutel = categorie
+                if not sleutel: # Eenmalige actie: altijd behouden, in volgorde
+                    self._volgnummer += 1
+                    sleutel = self._volgnummer
+                elif sleutel in self.pending:
+                    del self.pending[sleutel] # Vervangen, achteraan opnieuw toevoegen
+                    self.dropped += 1
+                self.pending[sleutel] = (actie, qos, categorie)
+                if self._timer is None:
+                    wacht = max(0.0, self._laatste_verzending + self.window - nu)
+                    self._timer = threading.Timer(wacht, self.flush)
+                    self._timer.daemon = True
+                    self._timer.start()
+                verzenden = []
+        self._send(verzenden)
+
+    # Verstuur wat verzameld is (einde van het venster)
+    def flush(self):
+        with self._lock:
+            verzenden = list(self.pending.values())
+            self.pending.clear()
+            self._timer = None
+            if verzenden:
+                self._laatste_verzending = time.monotonic()
+        self._send(verzenden)
+
+    def _send(self, acties):
+        if not acties:
+            return
+        if self.batch and len(acties) > 1: # Batch krijgt de strengste QoS van zijn commando's
+            samen = self.batch_separator.join(actie for actie, qos, categorie in acties)
+            get_latency_tracer().merge([actie for actie, qos, categorie in acties], samen)
+            self.mqtt_client.publish_command(samen, qos=max(qos for actie, qos, categorie in acties))
+            return
+        for actie, qos, categorie in acties:
+            self.mqtt_client.publish_command(actie, qos=qos, categorie=categorie)
+
+    def close(self):
+        with self._lock:
+            timer = self._timer
+        if timer is not None:
+            timer.cancel()
+        self.flush()
+
+# In-process MQTT broker voor tests en benchmarks (broker "loopback" in mqtt_config.json)
+# Ondersteunt subscribe met wildcards, publish met QoS 0/1, retained berichten, no_local
+# en ingestelde vertraging of verbroken verbindingen. Geen sockets, geen externe broker nodig.
+LOOPBACK_BROKER = "loopback"
+
+class LoopbackBroker:
+    def __init__(self, latency=0.0):
+        self.latency = latency # Seconden tot een bericht (of PUBACK) afgeleverd wordt
+        self.online = True # False: nieuwe verbindingen worden geweigerd
+        self.retained = {} # topic -> payload
+        self.clients = []
+        self.listeners = [] # (filter, functie(topic, payload)) binnen de broker, vb. een gesimuleerde controller
+        self.controllers = set() # (command_topic, state_topic) met een gesimuleerde controller
+        self.metrics = {"published": 0, "delivered": 0, "disconnects": 0}
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def matches(filter, topic): # MQTT wildcards: + (één niveau) en # (rest)
+        delen, niveaus = filter.split("/"), topic.split("/")
+        for i, deel in enumerate(delen):
+            if deel == "#":
+                return True
+            if i >= len(niveaus) or (deel != "+" and deel != niveaus[i]):
+                return False
+        return len(delen) == len(niveaus)
+    
+    def _attach(self, client):
+        with self._lock:
+            if not self.online:
+                return False
+            self.clients.append(client)
+            return True
+    
+    def _detach(self, client):
+        with self._lock:
+            if client in self.clients:
+                self.clients.remove(client)
+    
+    def publish(self, topic, payload, qos=0, retain=False, bron=None):
+        if isinstance(payload, str):
+            payload = payload.encode("utf-8")
+        with self._lock:
+            self.metrics["published"] += 1
+            if retain:
+                if payload:
+                    self.retained[topic] = payload
+                else:
+                    self.retained.pop(topic, None) # Leeg retained bericht wist de toestand
+            clients = list(self.clients)
+            listeners = list(self.listeners)
+        
+        for client in clients:
+            for filter, sub_qos, no_local in client.subs:
+                if self.matches(filter, topic):
+                    if not (no_local and client is bron):
+                        client._deliver(topic, payload, min(qos, sub_qos), False, self.latency)
+                        self.metrics["delivered"] += 1
+                    break
+        for filter, functie in listeners:
+            if self.matches(filter, topic):
+                if self.latency: # Ook de controller ontvangt het bericht pas na de vertraging
+                    threading.Timer(self.latency, functie, (topic, payload)).start()
+                else:
+                    functie(topic, payload)
+    
+    def _send_retained(self, client, filter, qos):
+        with self._lock:
+            retained = [(topic, payload) for topic, payload in self.retained.items() if self.matches(filter, topic)]
+        for topic, payload in retained:
+            client._deliver(topic, payload, qos, True, self.latency)
+    
+    # Simuleer een LED controller: elk commando wordt als retained toestand teruggemeld
+    def add_controller(self, command_topic, state_topic):
+        if (command_topic, state_topic) in self.controllers:
+            return
+        self.controllers.add((command_topic, state_topic))
+        self.listeners.append((command_topic, lambda topic, payload: self.publish(state_topic, payload, 1, True)))
+    
+    # Storing injecteren: alle clients verliezen hun verbinding
+    def disconnect_all(self):
+        with self._lock:
+            clients, self.clients = self.clients, []
+            self.metrics["disconnects"] += len(clients)
+        for client in clients:
+            client._lose_connection()
+
+# Bericht zoals paho het aan on_message geeft
+class LoopbackMessage:
+    def __init__(self, topic, payload, qos, retain):
+        self.topic = topic
+        self.payload = payload
+        self.qos = qos
+        self.retain = retain
+
+class LoopbackResult: # Zoals paho's MQTTMessageInfo (rc en mid)
+    def __init__(self, rc, mid=0):
+        self.rc = rc
+        self.mid = mid
+
+# Client met dezelfde methodes en callbacks (VERSION1 signaturen) als de paho client
+# die MqttClient gebruikt; callbacks lopen in de thread die loop() aanroept, net als bij paho
+class LoopbackClient:
+    def __init__(self, broker):
+        self.broker = broker
+        self.on_connect = None
+        self.on_disconnect = None
+        self.on_publish = None
+        self.on_message = None
+        self.subs = [] # (filter, qos, no_local)
+        self._events = [] # heap van (tijdstip, volgnummer, event)
+        self._volgnummer = 0
+        self._mid = 0
+        self._verbonden = False
+        self._condition = threading.Condition()
+    
+    def _push(self, vertraging, event):
+        with self._condition:
+            self._volgnummer += 1
+            heapq.heappush(self._events, (time.monotonic() + vertraging, self._volgnummer, event))
+            self._condition.notify_all()
+    
+    def _deliver(self, topic, payload, qos, retain, vertraging):
+        self._push(vertraging, ("message", LoopbackMessage(topic, payload, qos, retain)))
+    
+    def _lose_connection(self):
+        self._push(0, ("lost",))
+    
+    def connect(self, host, port=1883, keepalive=60, **opties):
+        if not self.broker._attach(self):
+            raise ConnectionRefusedError("loopback broker offline")
+        with self._condition:
+            self._events = []
+            self._verbonden = True
+        self._push(self.broker.latency, ("connack",))
+        return mqtt.MQTT_ERR_SUCCESS
+    
+    def disconnect(self, *args, **opties):
+        self.broker._detach(self)
+        self._push(0, ("disconnect",))
+        return mqtt.MQTT_ERR_SUCCESS
+    
+    def subscribe(self, topic, qos=0, options=None, properties=None):
+        if options is not None:
+            qos, no_local = options.QoS, options.noLocal
+        else:
+            no_local = False
+        self.subs = [sub for sub in self.subs if sub[0] != topic] + [(topic, qos, no_local)]
+        self.broker._send_retained(self, topic, qos)
+        return (mqtt.MQTT_ERR_SUCCESS, 0)
+    
+    def unsubscribe(self, topic, properties=None):
+        self.subs = [sub for sub in self.subs if sub[0] != topic]
+        return (mqtt.MQTT_ERR_SUCCESS, 0)
+    
+    def publish(self, topic, payload=None, qos=0, retain=False, properties=None):
+        if not self._verbonden:
+            return LoopbackResult(mqtt.MQTT_ERR_NO_CONN)
+        with self._condition:
+            self._mid += 1
+            mid = self._mid
+        self.broker.publish(topic, payload or b"", qos, retain, bron=self)
+        # PUBACK na een volledige rondreis, QoS 0 meldt paho meteen na het versturen
+        self._push(2 * self.broker.latency if qos > 0 else 0, ("puback", mid))
+        return LoopbackResult(mqtt.MQTT_ERR_SUCCESS, mid)
+    
+    # Verwerk wat klaar staat, zoals paho's client.loop()
+    def loop(self, timeout=1.0):
+        if not self._verbonden:
+            return mqtt.MQTT_ERR_NO_CONN
+        einde = time.monotonic() + timeout
+        with self._condition:
+            while True:
+                nu = time.monotonic()
+                if self._events and self._events[0][0] <= nu:
+                    break
+                wacht = min(einde, self._events[0][0]) - nu if self._events else einde - nu
+                if wacht <= 0:
+                    return mqtt.MQTT_ERR_SUCCESS
+                self._condition.wait(wacht)
+            klaar = []
+            while self._events and self._events[0][0] <= nu:
+                klaar.append(heapq.heappop(self._events)[2])
+        
+        for event in klaar:
+            soort = event[0]
+            if soort == "connack" and self.on_connect:
+                self.on_connect(self, None, {}, 0)
+            elif soort == "message" and self.on_message:
+                self.on_message(self, None, event[1])
+            elif soort == "puback" and self.on_publish:
+                self.on_publish(self, None, event[1])
+            elif soort in ("lost", "disconnect"):
+                self._verbonden = False
+                if self.on_disconnect:
+                    self.on_disconnect(self, None, 0 if soort == "disconnect" else 1)
+                return mqtt.MQTT_ERR_NO_CONN if soort == "disconnect" else mqtt.MQTT_ERR_CONN_LOST
+        return mqtt.MQTT_ERR_SUCCESS
+
+_loopback_broker = None
+
+def get_loopback_broker(): # Eén loopback broker per proces
+    global _loopback_broker
+    if _loopback_broker is None:
+        _loopback_broker = LoopbackBroker()
+    return _loopback_broker
 
 # ============================================================================
 # BUSINESS LOGIC - Parser Functions
 # ============================================================================
 
+# Splits tekst in kleine letters woorden (matching gebeurt altijd op hele woorden)
+def tokenize(tekst):
+    return re.findall(r"\w+", tekst.lower())
+
+# Aho-Corasick automaat op woordniveau voor één commando catalogus
+# Alle sleutels worden in één doorloop gevonden, enkel op woordgrenzen
+class CommandMatcher:
+    def __init__(self, catalogus):
+        self.goto = [{}] # Per toestand: woord -> volgende toestand
+        self.fail = [0] # Failure link per toestand
+        self.output = [None] # Index van het patroon dat in deze toestand eindigt
+        self.dict_link = [0] # Dichtstbijzijnde kortere toestand met een patroon
+        self.patterns = [] # (sleutel, waarde, aantal woorden)
+        self.vervolg = [set()] # Acties die nog bereikbaar zijn door verder te spreken
+        
+        for key, waarde in catalogus.items():
+            woorden = tokenize(key)
+            if woorden:
+                self._add(key, waarde, woorden)
+        self._build_links()
+    
+    def _add(self, key, waarde, woorden):
+        toestand = 0
+        for woord in woorden:
+            volgende = self.goto[toestand].get(woord)
+            if volgende is None:
+                volgende = len(self.goto)
+                self.goto[toestand][woord] = volgende
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append(None)
+                self.dict_link.append(0)
+                self.vervolg.append(set())
+            toestand = volgende
+        
+        if self.output[toestand] is None: # Bij dubbele sleutels wint de eerste uit de JSON
+            self.output[toestand] = len(self.patterns)
+            self.patterns.append((key, waarde, len(woorden)))
+    
+    def _build_links(self): # Breedte-eerst failure en dictionary links opbouwen
+        wachtrij = list(self.goto[0].values())
+        for toestand in wachtrij:
+            for woord, volgende in self.goto[toestand].items():
+                wachtrij.append(volgende)
+                
+                terug = self.fail[toestand]
+                while terug and woord not in self.goto[terug]:
+                    terug = self.fail[terug]
+                kandidaat = self.goto[terug].get(woord, 0)
+                self.fail[volgende] = kandidaat if kandidaat != volgende else 0
+                
+                doel = self.fail[volgende]
+                self.dict_link[volgende] = doel if self.output[doel] is not None else self.dict_link[doel]
+        
+        # Omgekeerde breedte-eerst volgorde: kinderen voor ouders
+        for toestand in reversed([0] + wachtrij):
+            for volgende in self.goto[toestand].values():
+                if self.output[volgende] is not None:
+                    self.vervolg[toestand].add(self.patterns[self.output[volgende]][1])
+                self.vervolg[toestand].update(self.vervolg[volgende])
+    
+    # Alle matches als (start woord, sleutel, waarde, aantal woorden) in één doorloop
+    def find_all(self, tekst):
+        matches = []
+        toestand = 0
+        for i, woord in enumerate(tokenize(tekst)):
+            while toestand and woord not in self.goto[toestand]:
+                toestand = self.fail[toestand]
+            toestand = self.goto[toestand].get(woord, 0)
+            
+            gevonden = toestand if self.output[toestand] is not None else self.dict_link[toestand]
+            while gevonden:
+                key, waarde, lengte = self.patterns[self.output[gevonden]]
+                matches.append((i - lengte + 1, key, waarde, lengte))
+                gevonden = self.dict_link[gevonden]
+        return matches
+    
+    # Beste match: langste sleutel (meeste woorden), bij gelijkstand de eerste in de zin
+    # Zelfde doorloop als find_all maar zonder lijst met alle matches op te bouwen
+    def best(self, tekst):
+        beste_patroon, beste_start, beste_lengte = None, 0, 0
+        toestand = 0
+        for i, woord in enumerate(tokenize(tekst)):
+            while toestand and woord not in self.goto[toestand]:
+                toestand = self.fail[toestand]
+            toestand = self.goto[toestand].get(woord, 0)
+            
+            gevonden = toestand if self.output[toestand] is not None else self.dict_link[toestand]
+            while gevonden:
+                patroon = self.output[gevonden]
+                lengte = self.patterns[patroon][2]
+                if lengte > beste_lengte: # Eerdere start wint bij gelijke lengte
+                    beste_patroon, beste_start, beste_lengte = patroon, i - lengte + 1, lengte
+                gevonden = self.dict_link[gevonden]
+        
+        if beste_patroon is None:
+            return None
+        key, waarde, lengte = self.patterns[beste_patroon]
+        return (beste_start, key, waarde, lengte)
+    
+    # Match die niet meer kan veranderen door verder te spreken (voor tussentijdse tekst)
+    # vb. "rood" is eenduidig zolang elk langer commando dat met "rood" begint ook rood is
+    def unambiguous(self, tekst):
+        match = self.best(tekst)
+        if match is None:
+            return None
+        
+        toestand = 0
+        for woord in tokenize(tekst):
+            while toestand and woord not in self.goto[toestand]:
+                toestand = self.fail[toestand]
+            toestand = self.goto[toestand].get(woord, 0)
+        
+        # Elk achtervoegsel van de tekst dat een begin van een sleutel is, telt mee
+        while toestand:
+            if self.vervolg[toestand] - {match[2]}:
+                return None
+            toestand = self.fail[toestand]
+        return match
+    
+    # Eenduidige match waar geen enkele langere sleutel meer op kan volgen
+    # vb. "zet het licht op rood" is af, "zet het licht" nog niet
+    def complete(self, tekst):
+        match = self.unambiguous(tekst)
+        if match is None:
+            return None
+        
+        toestand = 0
+        for woord in tokenize(tekst):
+            while toestand and woord not in self.goto[toestand]:
+                toestand = self.fail[toestand]
+            toestand = self.goto[toestand].get(woord, 0)
+        
+        while toestand:
+            if self.vervolg[toestand]:
+                return None
+            toestand = self.fail[toestand]
+        return match
+
+# Vereenvoudigde Nederlandse fonetische sleutel (klinkt gelijk -> zelfde sleutel)
+FONETISCHE_REGELS = (
+    (r"sch", "s"), (r"ch", "g"), (r"ij|y", "ei"), (r"auw|ouw|au", "ou"),
+    (r"dt\b|d\b", "t"), (r"ph", "f"), (r"th", "t"), (r"c(?=[eiy])", "s"),
+    (r"c|q", "k"), (r"x", "ks"), (r"z", "s"), (r"v", "f"), (r"gh", "g"),
+    (r"ie", "i"), (r"(?<=\w)h", ""), (r"(\w)\1+", r"\1")
+)
+FONETISCHE_PATRONEN = tuple((re.compile(patroon), vervanging) for patroon, vervanging in FONETISCHE_REGELS)
+
+def dutch_phonetic(tekst):
+    sleutel = " ".join(tokenize(tekst))
+    for patroon, vervanging in FONETISCHE_PATRONEN:
+        sleutel = patroon.sub(vervanging, sleutel)
+    return sleutel
+
+def trigrams(tekst): # Letter trigrammen per woord, met spatie als woordgrens
+    grammen = set()
+    for woord in tekst.split():
+        woord = f" {woord} "
+        grammen.update(woord[i:i + 3] for i in range(len(woord) - 2))
+    return grammen
+
+# Vooraf berekende fuzzy index (letter trigrammen + fonetische sleutel) over alle sleutels
+# Vangt bijna-juiste transcripties op die niet letterlijk in de catalogus staan
+class FuzzyIndex:
+    MAX_WOORDEN = 4 # Langste woordgroep uit de zin die vergeleken wordt
+    
+    def __init__(self, catalogus):
+        self.entries = []
+        self.max_woorden = 1
+        tekst_postings = {}
+        fon_postings = {}
+        tekst_lengtes = []
+        fon_lengtes = []
+        
+        for key, waarde in catalogus.items():
+            woorden = tokenize(key)
+            if not woorden:
+                continue
+            idx = len(self.entries)
+            self.entries.append((key, waarde))
+            self.max_woorden = max(self.max_woorden, min(len(woorden), FuzzyIndex.MAX_WOORDEN))
+            
+            tekst_grammen = trigrams(" ".join(woorden))
+            fon_grammen = trigrams(dutch_phonetic(key))
+            for gram in tekst_grammen:
+                tekst_postings.setdefault(gram, []).append(idx)
+            for gram in fon_grammen:
+                fon_postings.setdefault(gram, []).append(idx)
+            tekst_lengtes.append(len(tekst_grammen))
+            fon_lengtes.append(len(fon_grammen))
+        
+        # Postings als numpy arrays zodat tellen met één bincount gebeurt
+        self.tekst_postings = {g: np.array(ids, dtype=np.int32) for g, ids in tekst_postings.items()}
+        self.fon_postings = {g: np.array(ids, dtype=np.int32) for g, ids in fon_postings.items()}
+        self.tekst_lengtes = np.array(tekst_lengtes, dtype=np.float32)
+        self.fon_lengtes = np.array(fon_lengtes, dtype=np.float32)
+    
+    def _counts(self, woorden, postings): # Gedeelde trigrammen per woord (rij) en sleutel (kolom)
+        counts = np.zeros((len(woorden), len(self.entries)), dtype=np.float32)
+        lengtes = np.zeros(len(woorden), dtype=np.float32)
+        for i, grammen in enumerate(woorden):
+            lijsten = [postings[g] for g in grammen if g in postings]
+            if lijsten:
+                counts[i] = np.bincount(np.concatenate(lijsten), minlength=len(self.entries))
+            lengtes[i] = len(grammen)
+        return counts, lengtes
+    
+    # Beste kandidaat als (sleutel, waarde, score) of None onder de drempel
+    # Alle woordgroepen (1..max_woorden woorden) worden gevectoriseerd gescoord
+    def best(self, tekst, threshold):
+        woorden = tokenize(tekst)
+        if not self.entries or not woorden:
+            return None
+        
+        tekst_counts, tekst_q = self._counts([trigrams(w) for w in woorden], self.tekst_postings)
+        fon_counts, fon_q = self._counts([trigrams(dutch_phonetic(w)) for w in woorden], self.fon_postings)
+        
+        # Woordgroepen groeien één woord per stap: rij i = woorden i..i+lengte-1
+        tekst_venster, tekst_q_venster = tekst_counts.copy(), tekst_q.copy()
+        fon_venster, fon_q_venster = fon_counts.copy(), fon_q.copy()
+        
+        beste = None
+        for lengte in range(1, min(self.max_woorden, len(woorden)) + 1):
+            rijen = len(woorden) - lengte + 1
+            if lengte > 1:
+                tekst_venster[:rijen] += tekst_counts[lengte - 1:]
+                tekst_q_venster[:rijen] += tekst_q[lengte - 1:]
+                fon_venster[:rijen] += fon_counts[lengte - 1:]
+                fon_q_venster[:rijen] += fon_q[lengte - 1:]
+            
+            # Dice score: 2 * gedeeld / (trigrammen query + trigrammen sleutel)
+            tekst_score = tekst_venster[:rijen] / (tekst_q_venster[:rijen, None] + self.tekst_lengtes)
+            fon_score = fon_venster[:rijen] / (fon_q_venster[:rijen, None] + self.fon_lengtes)
+            score = tekst_score + fon_score # Gemiddelde van beide Dice scores
+            
+            rij, idx = np.unravel_index(int(np.argmax(score)), score.shape)
+            waarde = min(float(score[rij, idx]), 1.0)
+            if waarde >= threshold and (beste is None or waarde > beste[2]):
+                beste = (self.entries[idx][0], self.entries[idx][1], waarde)
+        return beste
+
+# Onveranderlijke, gecompileerde versie van beide catalogi (matchers, fuzzy index, grammatica)
+# Wordt in één keer opgebouwd en daarna enkel als geheel vervangen
+class CompiledCatalog:
+    EXTRA_ZINNEN = ("stop",) # Woorden die process_command zelf afhandelt
+    
+    def __init__(self, pc_commandos, led_commandos):
+        self.pc_commandos = pc_commandos
+        self.led_bron = led_commandos # Zoals in het bestand (met leveringsprofielen)
+        self.led_commandos, self.led_qos, self.led_categorie = CompiledCatalog._leveringsprofielen(led_commandos)
+        led_commandos = self.led_commandos
+        self.pc_matcher = CommandMatcher(pc_commandos)
+        self.led_matcher = CommandMatcher(led_commandos)
+        self.pc_fuzzy = FuzzyIndex(pc_commandos)
+        self.led_fuzzy = FuzzyIndex(led_commandos)
+        
+        # Alle zinnen als grammatica voor een lokale herkenner
+        zinnen = set(CompiledCatalog.EXTRA_ZINNEN)
+        for catalogus in (pc_commandos, led_commandos):
+            zinnen.update(" ".join(tokenize(key)) for key in catalogus)
+        self.grammar = tuple(sorted(zinnen))
+    
+    # Waarde "actie" of {"actie": ..., "profiel": "state|action|critical"} / {"actie": ..., "qos": 0-2}
+    # met optioneel "categorie" ("kleur", "modus", ... of null voor een eenmalige actie)
+    # Geeft (sleutel -> actie, actie -> qos, actie -> categorie), expliciete instellingen winnen
+    @staticmethod
+    def _leveringsprofielen(catalogus):
+        acties, instellingen, categorieen = {}, {}, {}
+        for key, waarde in catalogus.items():
+            instelling, categorie = None, False # False: geen categorie opgegeven
+            if isinstance(waarde, dict):
+                actie = waarde.get("actie")
+                if waarde.get("qos") in (0, 1, 2):
+                    instelling = waarde["qos"]
+                else:
+                    instelling = LEVERINGSPROFIELEN.get(waarde.get("profiel"))
+                if "categorie" in waarde:
+                    categorie = waarde["categorie"] if isinstance(waarde["categorie"], str) else None
+            else:
+                actie = waarde
+            if not isinstance(actie, str) or not actie:
+                continue
+            
+            acties[key] = actie
+            if instelling is not None and actie not in instellingen:
+                instellingen[actie] = instelling
+            if categorie is not False and actie not in categorieen:
+                categorieen[actie] = categorie or None
+        
+        # Standaard categorie: volgens de actie zelf, anders een woord uit een van haar zinnen
+        standaard = {}
+        for key, actie in acties.items():
+            if actie in categorieen:
+                continue
+            if standaard.get(actie) is None:
+                standaard[actie] = LED_CATEGORIEEN.get(actie) or next(
+                    (LED_CATEGORIEEN[woord] for woord in tokenize(key) if woord in LED_CATEGORIEEN), None
+                )
+        categorieen.update(standaard)
+        
+        qos = {actie: instellingen.get(actie, standaard_qos(categorieen[actie])) for actie in acties.values()}
+        return acties, qos, categorieen
+
 # Beheert alle PC en LED commando's uit JSON files
+# De gecompileerde catalogus wordt op schijf gecached (sleutel: mtime, grootte en hash)
 class CommandoManager:
-    def __init__(self, mqtt_client=None):
-        self.pc_commandos = {}
-        self.led_commandos = {}
+    BESTANDEN = ("pc_commandos.json", "led_commandos.json")
+    CACHE_FORMAAT = 4 # Verhogen als CompiledCatalog wijzigt
+    _code_hash = None
+    
+    def __init__(self, mqtt_client=None, executor=None, led_publisher=None):
         self.mqtt_client = mqtt_client
+        self.led_publisher = led_publisher # LedPublisher voor LED acties (None = direct via mqtt)
+        self.executor = executor # CommandExecutor voor PC acties (None = synchroon)
+        matching = load_spraak_config()["matching"]
+        self.fuzzy_enabled = matching["fuzzy"]
+        self.fuzzy_threshold = matching["fuzzy_threshold"]
+        self.versie = 0 # Verhoogt bij elke (her)laad van de catalogi
+        # (catalogus, pc objecten, led objecten) als één tuple zodat omwisselen atomisch is
+        # Objecten: actie -> vooraf aangemaakt PcCommando / LedCommando
+        self._actief = (CompiledCatalog({}, {}), {}, {})
+        self._bestand_info = None
+        self._lock = threading.Lock()
         self._load_commandos()
     
-    def _load_commandos(self):
+    @property
+    def catalogus(self):
+        return self._actief[0]
+    
+    @property
+    def pc_commandos(self):
+        return self.catalogus.pc_commandos
+    
+    @property
+    def led_commandos(self):
+        return self.catalogus.led_commandos
+    
+    def _stat_bestanden(self): # (mtime, grootte) per bestand, None als het ontbreekt
+        info = []
+        for bestand in CommandoManager.BESTANDEN:
+            try:
+                stat = os.stat(bestand)
+                info.append((stat.st_mtime_ns, stat.st_size))
+            except OSError:
+                info.append(None)
+        return tuple(info)
+    
+    # Herlaad de JSON catalogi als één van de bestanden gewijzigd is
+    def reload_if_changed(self):
+        if self._stat_bestanden() != self._bestand_info:
+            with self._lock:
+                self._load_commandos()
+            return True
+        return False
+    
+    # Grammatica voor een lokale herkenner, als (versie, zinnen)
+    # Herladen gebeurt door de ConfigWatcher, niet in het herkenningspad
+    def grammar(self):
+        return self.versie, self.catalogus.grammar
+    
+    def _lees_bestand(self, bestand):
         try:
-            with open("pc_commandos.json", "r", encoding="utf-8") as f:
-                self.pc_commandos = json.load(f) #laden van pc commando's
+            with open(bestand, "rb") as f:
+                return f.read()
         except FileNotFoundError:
-            self.pc_commandos = {}
-        except json.JSONDecodeError as e:
-            self.pc_commandos = {}
-        
+            return None
+    
+    # Ongeldige JSON (vb. half opgeslagen bestand) behoudt de vorige catalogus
+    def _parse_json(self, data, vorige):
+        if data is None:
+            return {}
         try:
-            with open("led_commandos.json", "r", encoding="utf-8") as f:
-                self.led_commandos = json.load(f) #laden van led commando's
-        except FileNotFoundError:
-            self.led_commandos = {}
-        except json.JSONDecodeError as e:
-            self.led_commandos = {}
+            catalogus = json.loads(data.decode("utf-8"))
+            return catalogus if isinstance(catalogus, dict) else vorige
+        except (json.JSONDecodeError, UnicodeDecodeError) as e:
+            return vorige
+    
+    # Cache in de eigen map van de gebruiker (nooit een pickle uit de werkmap laden),
+    # één bestand per werkmap omdat de sleutel de JSON bestanden van die map beschrijft
+    @staticmethod
+    def cache_pad():
+        if os.name == "nt":
+            basis = os.environ.get("LOCALAPPDATA") or os.path.expanduser("~")
+        else:
+            basis = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+        werkmap = hashlib.sha1(os.path.abspath(os.getcwd()).encode("utf-8")).hexdigest()[:12]
+        return os.path.join(basis, "spraakbesturing", f"commando_cache-{werkmap}.pickle")
+    
+    # Hash van deze broncode: tokenize, fonetische regels, categorieën, ... bepalen ook de catalogus
+    @staticmethod
+    def code_hash():
+        if CommandoManager._code_hash is None:
+            try:
+                with open(os.path.abspath(__file__), "rb") as f:
+                    CommandoManager._code_hash = hashlib.sha1(f.read()).hexdigest()
+            except Exception as e:
+                CommandoManager._code_hash = "" # Onbekend: de cache wordt nooit gebruikt
+        return CommandoManager._code_hash
+    
+    def _lees_cache(self):
+        code = CommandoManager.code_hash()
+        if not code:
+            return None
+        try:
+            with open(CommandoManager.cache_pad(), "rb") as f:
+                cache = pickle.load(f)
+            if cache.get("formaat") == CommandoManager.CACHE_FORMAAT and cache.get("code") == code:
+                return cache
+        except Exception as e:
+            pass
+        return None
+    
+    def _schrijf_cache(self, info, hashes, catalogus):
+        try:
+            pad = CommandoManager.cache_pad()
+            os.makedirs(os.path.dirname(pad), exist_ok=True)
+            tijdelijk = pad + ".tmp"
+            with open(tijdelijk, "wb") as f:
+                pickle.dump({
+                    "formaat": CommandoManager.CACHE_FORMAAT,
+                    "code": CommandoManager.code_hash(),
+                    "info": info,
+                    "hashes": hashes,
+                    "catalogus": catalogus
+                }, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tijdelijk, pad)
+        except Exception as e:
+            pass
+    
+    # Gecompileerde catalogus uit de cache of opnieuw opgebouwd uit de JSON bestanden
+    def _compile(self):
+        info = self._stat_bestanden()
+        cache = self._lees_cache()
+        
+        # Snelste pad: bestanden niet gewijzigd sinds de cache geschreven werd
+        if cache and cache["info"] == info:
+            return info, cache["catalogus"]
+        
+        inhoud = [self._lees_bestand(bestand) for bestand in CommandoManager.BESTANDEN]
+        hashes = tuple(hashlib.sha1(data).hexdigest() if data is not None else None for data in inhoud)
+        
+        # Enkel mtime veranderd (vb. bestand opnieuw opgeslagen), inhoud gelijk
+        if cache and cache["hashes"] == hashes:
+            catalogus = cache["catalogus"]
+        else:
+            vorige = self.catalogus
+            catalogus = CompiledCatalog(
+                self._parse_json(inhoud[0], vorige.pc_commandos),
+                self._parse_json(inhoud[1], vorige.led_bron)
+            )
+        
+        self._schrijf_cache(info, hashes, catalogus)
+        return info, catalogus
+    
+    def _load_commandos(self):
+        info, catalogus = self._compile()
+        
+        # Commando objecten 1x per actie aanmaken, matching maakt geen nieuwe objecten meer
+        pc_objecten = {actie: PcCommando(actie, executor=self.executor) for actie in catalogus.pc_commandos.values()}
+        led_objecten = {
+            actie: LedCommando(actie, mqtt_client=self.mqtt_client, publisher=self.led_publisher,
+                               qos=catalogus.led_qos[actie], categorie=catalogus.led_categorie[actie])
+            for actie in catalogus.led_commandos.values()
+        }
+        
+        # Wissel alles in één keer om
+        self._actief = (catalogus, pc_objecten, led_objecten)
+        self._bestand_info = info
+        self.versie += 1
+    
+    # Exacte match (langste op woordgrenzen), anders de beste fuzzy kandidaat
+    def _zoek_actie(self, matcher, fuzzy, tekst):
+        match = matcher.best(tekst)
+        if match:
+            return match[2]
+        
+        if self.fuzzy_enabled:
+            kandidaat = fuzzy.best(tekst, self.fuzzy_threshold)
+            if kandidaat:
+                print(f"Fuzzy match: '{tekst}' → '{kandidaat[0]}' ({kandidaat[2]:.2f})")
+                return kandidaat[1]
+        return None
     
     def get_pc_commando(self, tekst):
         if not tekst:
             return None
         
         # Zoek naar commando in pc tekst
-        for key in self.pc_commandos:
-            if key in tekst:
-                return PcCommando(self.pc_commandos[key])
+        catalogus, pc_objecten, led_objecten = self._actief
+        actie = self._zoek_actie(catalogus.pc_matcher, catalogus.pc_fuzzy, tekst)
+        if actie:
+            return pc_objecten.get(actie)
         
         return None
     
@@ -290,25 +1821,53 @@ class CommandoManager:
             return None
         
         # Zoek naar commando in led tekst
-        for key in self.led_commandos:
-            if key in tekst:
-                return LedCommando(self.led_commandos[key], mqtt_client=self.mqtt_client)
+        catalogus, pc_objecten, led_objecten = self._actief
+        actie = self._zoek_actie(catalogus.led_matcher, catalogus.led_fuzzy, tekst)
+        if actie:
+            return led_objecten.get(actie)
         
         return None
     
+    # Vroege uitvoering op tussentijdse tekst: enkel exacte, eenduidige matches
+    def get_unambiguous_pc_commando(self, tekst):
+        if not tekst:
+            return None
+        catalogus, pc_objecten, led_objecten = self._actief
+        match = catalogus.pc_matcher.unambiguous(tekst)
+        return pc_objecten.get(match[2]) if match else None
+    
+    def get_unambiguous_led_commando(self, tekst):
+        if not tekst:
+            return None
+        catalogus, pc_objecten, led_objecten = self._actief
+        match = catalogus.led_matcher.unambiguous(tekst)
+        return led_objecten.get(match[2]) if match else None
+    
+    # Tussentijdse tekst die al een volledig commando is (de zin mag eerder afgesloten worden)
+    def is_complete_command(self, tekst, modus):
+        if not tekst:
+            return False
+        catalogus = self.catalogus
+        matcher = catalogus.pc_matcher if modus == "PC" else catalogus.led_matcher
+        return matcher.complete(tekst.lower()) is not None
+    
     def is_valid_pc_command(self, tekst):
         if not tekst:
             return False
-        return any(key in tekst for key in self.pc_commandos.keys())
+        catalogus = self.catalogus
+        return self._zoek_actie(catalogus.pc_matcher, catalogus.pc_fuzzy, tekst) is not None
     
     def is_valid_led_command(self, tekst):
         if not tekst:
             return False
-        return any(key in tekst for key in self.led_commandos.keys())
+        catalogus = self.catalogus
+        return self._zoek_actie(catalogus.led_matcher, catalogus.led_fuzzy, tekst) is not None
 
 # Singleton instances (1x aanmaken, overal gebruiken)
 _commando_manager = None
 _mqtt_client = None
+_command_executor = None
+_led_publisher = None
 
 def get_mqtt_client(): # Singleton MQTT client
     global _mqtt_client
@@ -316,11 +1875,28 @@ def get_mqtt_client(): # Singleton MQTT client
         _mqtt_client = MqttClient()
     return _mqtt_client
 
+def get_command_executor(): # Singleton CommandExecutor
+    global _command_executor
+    if _command_executor is None:
+        _command_executor = CommandExecutor()
+    return _command_executor
+
+def get_led_publisher(): # Singleton LedPublisher
+    global _led_publisher
+    if _led_publisher is None:
+        led = load_spraak_config()["led"]
+        _led_publisher = LedPublisher(get_mqtt_client(), led["coalesce_ms"], led["batch"], led["batch_separator"])
+    return _led_publisher
+
 def get_commando_manager(): # Singleton CommandoManager
     global _commando_manager
     if _commando_manager is None:
         mqtt_client = get_mqtt_client()
-        _commando_manager = CommandoManager(mqtt_client=mqtt_client)
+        _commando_manager = CommandoManager(
+            mqtt_client=mqtt_client,
+            executor=get_command_executor(),
+            led_publisher=get_led_publisher()
+        )
     return _commando_manager
 
 def parse_Commando(tekst): # Parse PC commando uit tekst
@@ -343,19 +1919,935 @@ def parse_Led_Commando(tekst): # Parse LED commando uit tekst
 # BUSINESS LOGIC - Audio & Speech Recognition
 # ============================================================================
 
+# Stateful polyphase resampler (rate_in -> rate_out) met een windowed-sinc FIR
+# Enkel de uitgangssamples worden berekend, gevectoriseerd over een heel blok;
+# filtergeschiedenis en fase lopen door over blokken zodat er geen naden ontstaan.
+# Alle buffers worden vooraf gealloceerd: process() draait in de PortAudio callback
+class PolyphaseResampler:
+    def __init__(self, rate_in, rate_out, taps_per_phase=32, block_size=1024):
+        g = math.gcd(int(rate_in), int(rate_out))
+        self.up = int(rate_out) // g
+        self.down = int(rate_in) // g
+        self.taps = taps_per_phase
+        
+        # Laagdoorlaat in het opgesampelde domein, cutoff net onder de laagste Nyquist
+        lengte = self.up * taps_per_phase
+        cutoff = 0.85 / max(self.up, self.down)
+        n = np.arange(lengte) - (lengte - 1) / 2.0
+        h = cutoff * np.sinc(cutoff * n) * np.kaiser(lengte, 8.0) * self.up
+        # Tap k, fase p -> h[p + k*up], taps omgekeerd zodat venster x[i-taps+1..i] meteen past
+        self.taps_fasen = h.reshape(taps_per_phase, self.up)[::-1].astype(np.float32).copy()
+        
+        self.t = 0 # Positie (opgesampeld) van de volgende uitgang t.o.v. het volgende blok
+        self._reserveer(block_size)
+    
+    def _reserveer(self, block_size): # (Her)alloceer de werkbuffers voor blokken tot block_size
+        oud = getattr(self, "_invoer", None)
+        self._capaciteit = block_size
+        self._invoer = np.zeros(self.taps - 1 + block_size, dtype=np.float32) # Historie + blok
+        if oud is not None:
+            self._invoer[:self.taps - 1] = oud[:self.taps - 1]
+        m = block_size * self.up // self.down + 2 # Maximum aantal uitgangen per blok
+        self._stappen = np.arange(m, dtype=np.int64) * self.down
+        self._bron = np.empty(m, dtype=np.int64)
+        self._fase = np.empty(m, dtype=np.int64)
+        self._waarden = np.empty(m, dtype=np.float32)
+        self._coef = np.empty(m, dtype=np.float32)
+        self._uit = np.empty(m, dtype=np.float32)
+    
+    # Geeft een view op een interne buffer terug, geldig tot het volgende blok
+    def process(self, blok):
+        n = len(blok)
+        if n > self._capaciteit:
+            self._reserveer(n)
+        historie = self.taps - 1
+        self._invoer[historie:historie + n] = blok
+        
+        # Uitgangen op posities t, t+down, ... < n*up
+        einde = n * self.up
+        m = max(0, -(-(einde - self.t) // self.down))
+        bron, fase = self._bron[:m], self._fase[:m]
+        np.add(self._stappen[:m], self.t, out=bron)
+        np.remainder(bron, self.up, out=fase)
+        np.floor_divide(bron, self.up, out=bron) # Eerste invoersample van het venster per uitgang
+        
+        uit, waarden, coef = self._uit[:m], self._waarden[:m], self._coef[:m]
+        uit.fill(0.0)
+        for k in range(self.taps):
+            np.take(self._invoer, bron, out=waarden)
+            np.take(self.taps_fasen[k], fase, out=coef)
+            np.multiply(waarden, coef, out=waarden)
+            np.add(uit, waarden, out=uit)
+            np.add(bron, 1, out=bron)
+        np.clip(uit, -1.0, 1.0, out=uit) # Geen overloop bij de int16 conversie
+        
+        self._invoer[:historie] = self._invoer[n:n + historie]
+        self.t += m * self.down - einde
+        return uit
+
+# Eén capture engine die het audio device beheert (1 PortAudio stream)
+# Elk blok wordt als numpy view doorgegeven aan alle consumers (visualizer en spraakherkenning)
+class AudioCapture:
+    SAMPLE_RATE = 16000 # Sample rate die de spraakherkenning verwacht
+    BLOCK_SIZE = 1024 # Frames per blok bij SAMPLE_RATE (64 ms)
+
+    def __init__(self, device=None):
+        self.device = device
+        self.stream = None
+        self.rate = self.SAMPLE_RATE # Eigen sample rate van het device (na start)
+        self.block_size = self.BLOCK_SIZE # Blokgrootte bij self.rate, zelfde duur
+        self._consumers = () # Tuple zodat de audio thread zonder lock kan itereren
+        self._lock = threading.Lock()
+
+    def add_consumer(self, consumer):
+        with self._lock:
+            self._consumers = self._consumers + (consumer,)
+
+    def remove_consumer(self, consumer):
+        with self._lock:
+            self._consumers = tuple(c for c in self._consumers if c != consumer)
+
+    def _callback(self, indata, frames, time, status): # Draait in de PortAudio thread
+        if status:
+            print(f"Audio stream status: {status}")
+
+        blok = indata[:, 0] # View op kanaal 0, geen kopie
+        for consumer in self._consumers:
+            try:
+                consumer(blok)
+            except Exception as e:
+                print(f"Audio consumer fout: {e}")
+
+    # Eigen rate van het device: geen resampling in de driver of PortAudio
+    def _native_rate(self):
+        try:
+            return int(sd.query_devices(self.device, "input")["default_samplerate"])
+        except Exception as e:
+            return self.SAMPLE_RATE
+
+    def start(self, device=None):
+        self.close()
+        if device is not None:
+            self.device = device
+
+        self.rate = self._native_rate()
+        self.block_size = int(round(self.BLOCK_SIZE * self.rate / self.SAMPLE_RATE))
+        self.stream = sd.InputStream(
+            callback=self._callback,
+            channels=1,
+            device=self.device,
+            samplerate=self.rate,
+            blocksize=self.block_size,
+            dtype="float32"
+        )
+        self.stream.start()
+
+    @property
+    def active(self):
+        return self.stream is not None and self.stream.active
+
+    def pause(self):
+        if self.active:
+            self.stream.stop()
+
+    def resume(self):
+        if self.stream is not None and not self.stream.active:
+            self.stream.start()
+
+    def close(self):
+        if self.stream is not None:
+            try:
+                self.stream.stop()
+                self.stream.close()
+            except Exception as e:
+                pass
+            self.stream = None
+
+# Ringbuffer met vaste grootte voor int16 spraak audio (wordt 1x gealloceerd)
+# Blijft continu gevuld zodat een nieuwe luistersessie met pre-roll kan starten
+class AudioRingBuffer:
+    def __init__(self, capacity, pre_roll):
+        self.data = np.zeros(capacity, dtype=np.int16)
+        self.capacity = capacity
+        self.pre_roll = min(pre_roll, capacity)
+        self.write_pos = 0 # Totaal aantal geschreven samples (loopt altijd op)
+        self.read_pos = 0
+        self.interrupted = False
+        self.condition = threading.Condition()
+
+    def write(self, blok): # Consumer: float32 view → int16 in de ring, zonder allocatie
+        n = len(blok)
+        start = self.write_pos % self.capacity
+        eerste = min(n, self.capacity - start)
+        np.multiply(blok[:eerste], 32767, out=self.data[start:start + eerste], casting="unsafe")
+        if eerste < n:
+            np.multiply(blok[eerste:], 32767, out=self.data[:n - eerste], casting="unsafe")
+
+        with self.condition:
+            self.write_pos += n
+            self.condition.notify_all()
+
+    def start_session(self): # Begin te lezen pre_roll samples vóór de huidige positie
+        with self.condition:
+            # Nooit audio opnieuw lezen die een vorige sessie al verwerkte
+            self.read_pos = max(self.read_pos, self.write_pos - self.pre_roll)
+            self.interrupted = False
+
+    def interrupt(self): # Laat een wachtende read meteen terugkeren
+        with self.condition:
+            self.interrupted = True
+            self.condition.notify_all()
+
+    def clear_interrupt(self): # Onderbreking afgehandeld, ook zonder nieuwe sessie (vb. snel mute/unmute)
+        with self.condition:
+            self.interrupted = False
+
+    def read(self, size, timeout):
+        with self.condition:
+            self.condition.wait_for(
+                lambda: self.interrupted or self.write_pos - self.read_pos >= size, timeout
+            )
+            if self.interrupted or self.write_pos - self.read_pos < size:
+                return b"" # Geen audio (gepauzeerd of onderbroken)
+
+            # Lezer te ver achter: spring terug naar recente audio
+            if self.write_pos - self.read_pos > self.capacity:
+                self.read_pos = self.write_pos - self.pre_roll
+
+            start = self.read_pos % self.capacity
+            self.read_pos += size
+
+        if start + size <= self.capacity:
+            return self.data[start:start + size].tobytes()
+        return np.concatenate((self.data[start:], self.data[:start + size - self.capacity])).tobytes()
+
+# Audio bron voor speech_recognition die leest uit de gedeelde AudioCapture
+# i.p.v. een eigen PyAudio stream te openen. De ringbuffer blijft gevuld
+# zolang de capture loopt, een sessie ('with') houdt de bron open over alle zinnen.
+# Audio wordt hier 1x omgezet naar 16 kHz mono int16, het formaat van elke backend.
+class CaptureSource(sr.AudioSource):
+    SAMPLE_WIDTH = 2 # int16
+
+    def __init__(self, capture, buffer_seconds=10, pre_roll_seconds=0.5, read_timeout=1.0):
+        self.capture = capture
+        self.SAMPLE_RATE = capture.SAMPLE_RATE
+        self.CHUNK = capture.BLOCK_SIZE
+        self.read_timeout = read_timeout
+        self.buffer = AudioRingBuffer(
+            int(buffer_seconds * self.SAMPLE_RATE),
+            int(pre_roll_seconds * self.SAMPLE_RATE)
+        )
+        self.resampler = None
+        self._resampler_rate = self.SAMPLE_RATE
+        self.capture.add_consumer(self._write)
+        self.stream = None
+
+    def _write(self, blok): # Consumer in de audio thread
+        if self.capture.rate != self._resampler_rate: # Ander device: nieuwe filter
+            self._resampler_rate = self.capture.rate
+            self.resampler = None
+            if self._resampler_rate != self.SAMPLE_RATE:
+                self.resampler = PolyphaseResampler(self._resampler_rate, self.SAMPLE_RATE, block_size=self.capture.block_size)
+        if self.resampler is not None:
+            blok = self.resampler.process(blok)
+        self.buffer.write(blok)
+
+    def __enter__(self):
+        self.buffer.start_session()
+        self.stream = self
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stream = None
+
+    def read(self, size):
+        return self.buffer.read(size, self.read_timeout)
+
+    def close(self):
+        self.capture.remove_consumer(self._write)
+
+# Niveaumeter tussen de audio thread en de gui zonder locks, queues of Tk aanroepen
+# De callback schrijft enkel in een vooraf gealloceerde array, de gui tick leest de laatste waarden
+class LevelMeter:
+    RMS, PEAK, BLOKKEN, LUID = 0, 1, 2, 3
+
+    def __init__(self, window=2048):
+        self.slot = np.zeros(4, dtype=np.float64) # rms, piek, aantal blokken, luide blokken (één schrijver)
+        self.venster = np.zeros(window, dtype=np.float32) # Laatste samples voor de spectrum weergave
+        self._pos = 0
+        self.wake_level = 5 / 680 # rms waarboven een blok als geluid telt (maakt de visualizer wakker)
+
+    def __call__(self, blok): # Consumer in de audio thread
+        slot = self.slot
+        slot[0] = math.sqrt(np.dot(blok, blok) / len(blok))
+        slot[1] = max(blok.max(), -blok.min())
+        
+        # Blok in het circulaire venster kopiëren (geen allocatie)
+        venster = self.venster
+        blok = blok[-len(venster):]
+        n, pos = len(blok), self._pos
+        eerste = min(n, len(venster) - pos)
+        venster[pos:pos + eerste] = blok[:eerste]
+        venster[:n - eerste] = blok[eerste:]
+        self._pos = (pos + n) % len(venster)
+        slot[2] += 1
+        if slot[0] > self.wake_level: # Ook korte geluiden tussen twee trage gui ticks blijven zichtbaar
+            slot[3] += 1
+
+    def read(self): # (rms, piek, aantal blokken) vanuit de gui thread
+        slot = self.slot
+        return slot[0], slot[1], int(slot[2])
+
+    def loud_blocks(self): # Aantal blokken boven wake_level sinds de start
+        return int(self.slot[3])
+
+    def window(self): # Kopie van de laatste samples, oudste eerst
+        pos = self._pos
+        return np.concatenate((self.venster[pos:], self.venster[:pos]))
+
+# Spectrum van een audio venster in log-verdeelde banden (voor de visualizer)
+# Hann venster + rfft, vensters en band grenzen worden per (lengte, rate) 1x berekend
+class SpectrumAnalyzer:
+    def __init__(self, bands, min_db=-70.0, max_db=-10.0, fmin=80.0, fmax=8000.0):
+        self.bands = bands
+        self.min_db = min_db # Niveau (dBFS) voor een lege bar
+        self.max_db = max_db # Niveau (dBFS) voor een volle bar
+        self.fmin = fmin
+        self.fmax = fmax
+        self._plan = None # (lengte, rate, venster, band starts, bins per band)
+
+    def _maak_plan(self, n, rate):
+        venster = np.hanning(n).astype(np.float32)
+        freqs = np.fft.rfftfreq(n, 1.0 / rate)
+        grenzen = np.geomspace(self.fmin, min(self.fmax, rate / 2.0), self.bands + 1)
+        starts = np.searchsorted(freqs, grenzen)
+        # Elke band minstens 1 bin (lage banden zijn smaller dan de bin afstand)
+        volgnummer = np.arange(len(starts))
+        starts = np.maximum.accumulate(starts - volgnummer) + volgnummer
+        starts = np.minimum(starts, len(freqs) - 1 - volgnummer[::-1])
+        # Versterking zodat een sinus op volle schaal 0 dBFS geeft
+        schaal = (2.0 / venster.sum()) ** 2
+        self._plan = (n, rate, venster, starts, np.diff(starts), schaal)
+        return self._plan
+
+    # Genormaliseerd niveau (0-1) per band
+    def process(self, samples, rate):
+        plan = self._plan
+        if plan is None or plan[0] != len(samples) or plan[1] != rate:
+            plan = self._maak_plan(len(samples), rate)
+        n, rate, venster, starts, breedtes, schaal = plan
+        
+        spectrum = np.fft.rfft(samples * venster)
+        vermogen = (spectrum.real ** 2 + spectrum.imag ** 2) * schaal
+        per_band = np.add.reduceat(vermogen[:starts[-1]], starts[:-1]) / breedtes
+        db = 10.0 * np.log10(per_band + 1e-12)
+        return np.clip((db - self.min_db) / (self.max_db - self.min_db), 0.0, 1.0)
+
+# Voice activity detector op de capture buffers (per frame van 10-30 ms)
+# Gevectoriseerd over alle frames van een blok: energie, zero-crossing rate en spectrale vlakheid
+# Ventilatoren en ruis zijn spectraal vlak of hebben een hoge zcr, spraak niet
+class VoiceActivityDetector:
+    def __init__(self, sample_rate, frame_ms=20, energy_margin_db=10.0, max_flatness=0.5, max_zcr=0.5):
+        self.sample_rate = sample_rate
+        self.frame_len = int(sample_rate * frame_ms / 1000)
+        self.frame_duur = self.frame_len / sample_rate
+        self.energy_margin_db = energy_margin_db # Hoeveel dB boven de ruisvloer spraak moet zijn
+        self.max_flatness = max_flatness # 0 = zuivere toon, 1 = witte ruis
+        self.max_zcr = max_zcr # Zero-crossings per sample
+        self.noise_db = -60.0 # Ruisvloer, aangepast door calibrate() en tijdens stilte
+        
+        self.venster = np.hanning(self.frame_len).astype(np.float32)
+        frequenties = np.fft.rfftfreq(self.frame_len, 1.0 / sample_rate)
+        self.spraak_band = (frequenties >= 250) & (frequenties <= 4000) # Band voor de vlakheid
+        self._rest = np.zeros(0, dtype=np.float32) # Samples die nog geen volledig frame vormen
+    
+    def reset(self):
+        self._rest = np.zeros(0, dtype=np.float32)
+    
+    def _features(self, samples): # (energie dB, zcr, vlakheid) per volledig frame
+        samples = np.concatenate((self._rest, samples.astype(np.float32) / 32768.0))
+        aantal = len(samples) // self.frame_len
+        self._rest = samples[aantal * self.frame_len:]
+        frames = samples[:aantal * self.frame_len].reshape(aantal, self.frame_len)
+        
+        energie_db = 10.0 * np.log10(np.mean(frames * frames, axis=1) + 1e-10)
+        zcr = np.mean(np.abs(np.diff(np.signbit(frames), axis=1)), axis=1)
+        
+        spectrum = np.abs(np.fft.rfft(frames * self.venster, axis=1))[:, self.spraak_band] ** 2 + 1e-12
+        vlakheid = np.exp(np.mean(np.log(spectrum), axis=1)) / np.mean(spectrum, axis=1)
+        return energie_db, zcr, vlakheid
+    
+    # Meet de ruisvloer op stille audio (tijdens het kalibreren)
+    def calibrate(self, samples):
+        energie_db, zcr, vlakheid = self._features(samples)
+        if len(energie_db):
+            self.noise_db = float(np.percentile(energie_db, 50))
+    
+    # Spraak ja/nee per frame (bool array) voor een blok int16 samples
+    def process(self, samples):
+        energie_db, zcr, vlakheid = self._features(samples)
+        spraak = (
+            (energie_db > self.noise_db + self.energy_margin_db)
+            & (vlakheid < self.max_flatness)
+            & (zcr < self.max_zcr)
+        )
+        
+        # Ruisvloer volgen: snel omlaag, traag omhoog, enkel op frames zonder spraak
+        for waarde in energie_db[~spraak]:
+            if waarde < self.noise_db:
+                self.noise_db = 0.7 * self.noise_db + 0.3 * float(waarde)
+            else:
+                self.noise_db = 0.995 * self.noise_db + 0.005 * float(waarde)
+        return spraak
+
+# Bepaalt begin en einde van een zin op basis van de VAD beslissingen
+# Vervangt speech_recognition's listen() met energy_threshold
+# Leert de pauze- en zinslimieten uit recent herkende commando's
+# Per context (microfoon + modus): de langste pauze binnen een commando en de langste spraakduur
+class EndpointPolicy:
+    def __init__(self, pause_threshold=0.8, min_pause=0.3, margin=0.15, history=50, min_samples=5,
+                 length_margin=1.3):
+        self.default_pause = pause_threshold # Bovengrens, ook gebruikt zolang er te weinig data is
+        self.min_pause = min_pause # Nooit korter afsluiten dan dit
+        self.margin = margin # Extra seconden boven de geleerde pauze
+        self.min_samples = min_samples
+        self.length_margin = length_margin # Factor boven het langste commando
+        self.history = history
+        self._pauzes = {} # context -> deque met langste pauze per commando
+        self._lengtes = {} # context -> deque met spraakduur per commando
+        self._lock = threading.Lock()
+    
+    # Statistieken van een zin die een geldig commando opleverde
+    def record(self, context, langste_pauze, spraak_duur):
+        with self._lock:
+            self._pauzes.setdefault(context, collections.deque(maxlen=self.history)).append(langste_pauze)
+            self._lengtes.setdefault(context, collections.deque(maxlen=self.history)).append(spraak_duur)
+    
+    def pause_threshold(self, context):
+        with self._lock:
+            pauzes = self._pauzes.get(context)
+            if not pauzes or len(pauzes) < self.min_samples:
+                return self.default_pause
+            geleerd = float(np.percentile(np.fromiter(pauzes, dtype=np.float64), 95)) + self.margin
+        return min(self.default_pause, max(self.min_pause, geleerd))
+    
+    # Spraakduur waarna geen langer commando meer te verwachten valt (None = onbekend)
+    def max_phrase(self, context):
+        with self._lock:
+            lengtes = self._lengtes.get(context)
+            if not lengtes or len(lengtes) < self.min_samples:
+                return None
+            return max(lengtes) * self.length_margin
+
+class Endpointer:
+    def __init__(self, vad, pause_threshold=0.8, timeout=3.0, phrase_time_limit=5.0,
+                 start_frames=4, start_window=6, pre_speech=0.3, trailing_silence=0.2, policy=None):
+        self.vad = vad
+        self.default_pause = pause_threshold
+        self.pause_threshold = pause_threshold # Seconden stilte die een zin afsluiten
+        self.timeout = timeout # Maximaal wachten op het begin van een zin
+        self.phrase_time_limit = phrase_time_limit # Maximale lengte van een zin
+        self.start_frames = start_frames # Aantal spraak frames binnen start_window om te starten
+        self.start_window = start_window
+        self.pre_speech = pre_speech # Seconden audio vóór het begin die meegegeven worden
+        self.trailing_silence = trailing_silence # Seconden stilte die na de zin behouden blijven
+        self.policy = policy # EndpointPolicy voor geleerde limieten (optioneel)
+        self.max_spraak = None # Spraakduur waarna een korte pauze volstaat
+        self.laatste_stilte = 0.0 # Stilte aan het einde van de laatste zin
+        self.laatste_pauze = 0.0 # Langste pauze binnen de laatste zin
+        self.laatste_duur = 0.0 # Spraakduur van de laatste zin (zonder stilte op het einde)
+        self._vroeg_klaar = False
+    
+    # Limieten voor de volgende zin volgens wat geleerd is in deze context
+    def prepare(self, context):
+        self._vroeg_klaar = False
+        if self.policy is None:
+            self.pause_threshold, self.max_spraak = self.default_pause, None
+            return
+        self.pause_threshold = self.policy.pause_threshold(context)
+        self.max_spraak = self.policy.max_phrase(context)
+    
+    # De tekst tot nu toe is al een volledig commando: afsluiten na een korte pauze
+    def finish_early(self):
+        self._vroeg_klaar = True
+    
+    def _korte_pauze(self):
+        return self.policy.min_pause if self.policy else min(0.3, self.pause_threshold)
+    
+    # Kalibreer de ruisvloer van de VAD op de huidige omgeving
+    def calibrate(self, source, duration=1.0):
+        blokken = []
+        gelezen = 0.0
+        while gelezen < duration:
+            data = source.stream.read(source.CHUNK)
+            if not data:
+                break
+            blokken.append(np.frombuffer(data, dtype=np.int16))
+            gelezen += source.CHUNK / source.SAMPLE_RATE
+        if blokken:
+            self.vad.reset()
+            self.vad.calibrate(np.concatenate(blokken))
+        self.vad.reset()
+    
+    # Generator met de audio (bytes) van één zin zodra die gedetecteerd wordt
+    # Eerste stuk bevat de audio vlak voor het begin, gooit sr.WaitTimeoutError na timeout
+    def segment(self, source):
+        blok_duur = source.CHUNK / source.SAMPLE_RATE
+        voor_spraak = collections.deque(maxlen=max(1, int(math.ceil(self.pre_speech / blok_duur)) + 1))
+        recent = collections.deque(maxlen=self.start_window)
+        gewacht = 0.0
+        
+        # Wachten op het begin van een zin
+        while True:
+            data = source.stream.read(source.CHUNK)
+            if not data: # Gepauzeerd of onderbroken
+                return
+            beslissingen = self.vad.process(np.frombuffer(data, dtype=np.int16))
+            voor_spraak.append(data)
+            recent.extend(beslissingen)
+            gewacht += blok_duur
+            
+            if sum(recent) >= self.start_frames:
+                break
+            if self.timeout and gewacht > self.timeout:
+                raise sr.WaitTimeoutError("geen spraak binnen de timeout")
+        
+        yield b"".join(voor_spraak)
+        recent.clear()
+        
+        # Opnemen tot er pause_threshold stilte is of de zin te lang wordt
+        # Korte pauze volstaat als het langste commando al ingesproken is of de tekst af is
+        duur = 0.0
+        stilte = 0.0
+        langste_pauze = 0.0
+        while True:
+            data = source.stream.read(source.CHUNK)
+            if not data:
+                break
+            beslissingen = self.vad.process(np.frombuffer(data, dtype=np.int16))
+            yield data
+            duur += blok_duur
+            
+            for spraak in beslissingen:
+                if spraak:
+                    langste_pauze = max(langste_pauze, stilte)
+                    stilte = 0.0
+                else:
+                    stilte += self.vad.frame_duur
+            
+            pauze = self.pause_threshold
+            if self._vroeg_klaar or (self.max_spraak and duur - stilte >= self.max_spraak):
+                pauze = min(pauze, self._korte_pauze())
+            if stilte >= pauze or duur >= self.phrase_time_limit:
+                break
+        self.laatste_stilte = stilte
+        self.laatste_pauze = langste_pauze
+        self.laatste_duur = max(0.0, duur - stilte)
+    
+    # Volledige zin als AudioData, zonder overbodige stilte op het einde
+    def listen(self, source):
+        data = b"".join(self.segment(source))
+        te_veel = max(0.0, self.laatste_stilte - self.trailing_silence)
+        bytes_weg = int(te_veel * source.SAMPLE_RATE) * source.SAMPLE_WIDTH
+        if bytes_weg:
+            data = data[:max(0, len(data) - bytes_weg)]
+        return sr.AudioData(data, source.SAMPLE_RATE, source.SAMPLE_WIDTH)
+
 # Audio verwerking en spraakherkenning instellingen
 class AudioProcessor:
     @staticmethod
-    def configure_recognizer():
-        herkenner = sr.Recognizer()
-        herkenner.energy_threshold = 4000 #basis energie drempel
-        herkenner.dynamic_energy_threshold = True #automatische aanpassing energie drempel
-        herkenner.dynamic_energy_adjustment_damping = 0.15 #snelheid van aanpassing
-        herkenner.dynamic_energy_ratio = 1.5 #versterking van energie drempel
-        herkenner.pause_threshold = 0.8 #tijd in seconden voor pauze
-        herkenner.phrase_threshold = 0.2 #minimale tijd voor spraak
-        herkenner.non_speaking_duration = 0.5 #tijd voor en na spraak
-        return herkenner
+    def configure_endpointer(config, sample_rate):
+        vad = VoiceActivityDetector(
+            sample_rate,
+            frame_ms=config["frame_ms"], #lengte van een analyse frame (10-30 ms)
+            energy_margin_db=config["energy_margin_db"], #dB boven de ruisvloer voor spraak
+            max_flatness=config["max_flatness"], #vlakker spectrum = ruis (ventilator)
+            max_zcr=config["max_zcr"] #hogere zero-crossing rate = sis ruis
+        )
+        policy = None
+        if config["adaptive"]:
+            policy = EndpointPolicy(
+                pause_threshold=config["pause_threshold"],
+                min_pause=config["min_pause"] #kortste pauze die een zin afsluit
+            )
+        return Endpointer(
+            vad,
+            pause_threshold=config["pause_threshold"], #tijd in seconden voor pauze (bovengrens)
+            timeout=config["timeout"], #maximaal wachten op spraak
+            phrase_time_limit=config["phrase_time_limit"], #maximale lengte van een zin
+            policy=policy
+        )
+
+# Basis voor spraakherkenning backends
+# recognize() geeft tekst terug of gooit sr.UnknownValueError / sr.RequestError
+class RecognizerBackend:
+    name = "basis"
+    offline = False
+    supports_streaming = False # Tussentijdse resultaten tijdens het inspreken
+    
+    def recognize(self, audio):
+        raise NotImplementedError("moet worden overschreven!")
+    
+    # Streaming sessie met feed(bytes) -> tussentijdse tekst en finish() -> eindtekst
+    def start_stream(self, sample_rate):
+        raise NotImplementedError("backend ondersteunt geen streaming")
+    
+    # Beperk de herkenning tot vaste zinnen (alleen voor lokale engines)
+    # grammar_provider() geeft (versie, zinnen) terug
+    def set_grammar_provider(self, grammar_provider):
+        pass
+
+# Online herkenning via de Google Web Speech API
+class GoogleBackend(RecognizerBackend):
+    name = "google"
+    offline = False
+    
+    def __init__(self, language="nl-NL"):
+        self.language = language
+        self.herkenner = sr.Recognizer()
+    
+    def recognize(self, audio):
+        return self.herkenner.recognize_google(audio, language=self.language)
+
+# Offline herkenning op de CPU met Vosk (model wordt 1x geladen)
+class VoskBackend(RecognizerBackend):
+    name = "vosk"
+    offline = True
+    supports_streaming = True
+    
+    def __init__(self, model_path):
+        try:
+            import vosk # Optioneel, alleen nodig voor offline herkenning
+        except ImportError:
+            raise RuntimeError("Vosk is niet geïnstalleerd (pip install vosk)")
+        
+        if not os.path.isdir(model_path):
+            raise RuntimeError(f"Vosk model niet gevonden: {model_path}")
+        
+        vosk.SetLogLevel(-1)
+        self.vosk = vosk
+        self.model = vosk.Model(model_path)
+        self.grammar_provider = None
+        self._grammar_versie = None
+        self._grammar_json = None
+    
+    def set_grammar_provider(self, grammar_provider):
+        self.grammar_provider = grammar_provider
+    
+    def _current_grammar(self): # JSON grammatica, opnieuw opgebouwd als de catalogi wijzigen
+        if self.grammar_provider is None:
+            return None
+        versie, zinnen = self.grammar_provider()
+        if versie != self._grammar_versie:
+            # "[unk]" vangt alles op wat niet in de catalogi staat
+            self._grammar_json = json.dumps(list(zinnen) + ["[unk]"], ensure_ascii=False)
+            self._grammar_versie = versie
+        return self._grammar_json
+    
+    def _new_recognizer(self, sample_rate):
+        grammar = self._current_grammar()
+        if grammar:
+            return self.vosk.KaldiRecognizer(self.model, sample_rate, grammar)
+        return self.vosk.KaldiRecognizer(self.model, sample_rate)
+    
+    def recognize(self, audio):
+        herkenner = self._new_recognizer(audio.sample_rate)
+        herkenner.AcceptWaveform(audio.frame_data) # Al 16 kHz mono int16 uit de capture
+        tekst = json.loads(herkenner.FinalResult()).get("text", "")
+        tekst = tekst.replace("[unk]", "").strip()
+        if not tekst:
+            raise sr.UnknownValueError()
+        return tekst
+    
+    def start_stream(self, sample_rate):
+        return VoskBackend.Stream(self._new_recognizer(sample_rate))
+    
+    # Eén zin incrementeel decoderen (feed vanuit de listener, finish in de pool)
+    class Stream:
+        def __init__(self, herkenner):
+            self.herkenner = herkenner
+            self.delen = [] # Afgesloten stukken binnen dezelfde zin
+        
+        def _tekst(self, *extra):
+            return " ".join(self.delen + [deel for deel in extra if deel]).replace("[unk]", "").strip()
+        
+        def feed(self, data):
+            if self.herkenner.AcceptWaveform(data):
+                deel = json.loads(self.herkenner.Result()).get("text", "")
+                if deel:
+                    self.delen.append(deel)
+                return self._tekst()
+            return self._tekst(json.loads(self.herkenner.PartialResult()).get("partial", ""))
+        
+        def finish(self):
+            tekst = self._tekst(json.loads(self.herkenner.FinalResult()).get("text", ""))
+            if not tekst:
+                raise sr.UnknownValueError()
+            return tekst
+
+# Maak de backend uit de "recognizer" sectie van spraak_config.json
+# Valt terug op Google als de offline backend niet beschikbaar is
+def create_recognizer_backend(config, grammar_provider=None):
+    backend = config.get("backend", "google")
+    
+    if backend == "vosk":
+        try:
+            vosk_backend = VoskBackend(config.get("vosk_model"))
+            if config.get("grammar", True) and grammar_provider:
+                vosk_backend.set_grammar_provider(grammar_provider)
+            return vosk_backend
+        except Exception as e:
+            print(f"Offline herkenning niet beschikbaar, terug naar Google: {e}")
+    elif backend != "google":
+        print(f"Onbekende recognizer backend '{backend}', terug naar Google")
+    
+    return GoogleBackend(language=config.get("language", "nl-NL"))
+
+# Kleine pool van herkenning workers achter een begrensde queue
+# Capture en herkenning lopen zo parallel, resultaten komen in volgorde van inspreken terug
+class RecognitionPool:
+    def __init__(self, on_result, workers=2, max_pending=4):
+        self.on_result = on_result # on_result(tag, tekst, fout), altijd in volgorde van submit
+        self.jobs = queue.Queue(maxsize=max_pending)
+        self._next_seq = 0 # Volgnummer voor de volgende zin (alleen de listener thread)
+        self._deliver_seq = 0 # Volgnummer dat als volgende afgeleverd wordt
+        self._results = {} # Klaar maar nog niet aan de beurt: seq -> (tag, tekst, fout)
+        self._lock = threading.Lock()
+        self._workers = []
+        
+        for i in range(max(1, workers)):
+            worker = threading.Thread(target=self._work, name=f"herkenning-{i}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+    
+    # Plaats een herkenning (job() -> tekst) in de queue, False als de queue vol blijft
+    def submit(self, job, tag=None, timeout=None):
+        try:
+            self.jobs.put((self._next_seq, job, tag), timeout=timeout)
+        except queue.Full:
+            return False
+        self._next_seq += 1
+        return True
+    
+    @property
+    def pending(self):
+        return self._next_seq - self._deliver_seq
+    
+    def _work(self):
+        while True:
+            job = self.jobs.get()
+            if job is None: # Afsluiten
+                break
+            
+            seq, herken, tag = job
+            tekst, fout = None, None
+            try:
+                tekst = herken()
+            except Exception as e:
+                fout = e
+            self._complete(seq, tag, tekst, fout)
+    
+    def _complete(self, seq, tag, tekst, fout): # Lever af in volgorde, wacht op oudere zinnen
+        with self._lock:
+            self._results[seq] = (tag, tekst, fout)
+            while self._deliver_seq in self._results:
+                tag, tekst, fout = self._results.pop(self._deliver_seq)
+                self._deliver_seq += 1
+                try:
+                    self.on_result(tag, tekst, fout)
+                except Exception as e:
+                    print(f"Fout bij verwerken herkenning: {e}")
+    
+    def close(self):
+        for worker in self._workers:
+            try:
+                self.jobs.put_nowait(None)
+            except queue.Full:
+                pass
+
+# Eén blijvende luister thread met expliciete toestanden
+# Idle en muted wachten op een Condition (0% CPU), de capture wordt gepauzeerd bij mute
+class SpraakListener:
+    IDLE = "idle"
+    MUTED = "muted"
+    CALIBRATING = "calibrating"
+    LISTENING = "listening"
+    RECOGNIZING = "recognizing"
+
+    MAX_ERRORS = 5 # Na zoveel fouten op rij stopt het luisteren
+
+    def __init__(self, capture, source, backend, endpointer, on_text, on_status=None, on_stopped=None,
+                 workers=2, max_pending=4, on_partial=None, streaming=True, is_complete=None):
+        self.capture = capture
+        self.source = source
+        self.backend = backend # RecognizerBackend (google, vosk, ...)
+        self.pool = RecognitionPool(self._on_result, workers, max_pending)
+        self.streaming = streaming and backend.supports_streaming
+        self.on_text = on_text # Herkende eindtekst: on_text(zin_id, tekst)
+        self.on_partial = on_partial # Tussentijdse tekst: on_partial(zin_id, tekst)
+        self.on_status = on_status # Status tekst voor de gui
+        self.on_stopped = on_stopped # Luisteren gestopt na te veel fouten
+        self.state = SpraakListener.IDLE
+        self.endpointer = endpointer # VAD gebaseerde begin/einde detectie
+        self.is_complete = is_complete # is_complete(tekst): tussentijdse tekst is al een volledig commando
+        self.context = None # Spreker/catalogus waarvoor de endpointer limieten leert (gezet door de gui)
+        self._zin_stats = {} # zin_id -> (context, langste pauze, spraakduur)
+
+        self._condition = threading.Condition()
+        self._listening = False
+        self._muted = False
+        self._closed = False
+        self._calibrated = False
+        self._error_count = 0
+        self._zin_id = 0 # Volgnummer van de opgenomen zin (koppelt partial en eindresultaat)
+        self._thread = threading.Thread(target=self._run, name="spraak-listener", daemon=True)
+        self._thread.start()
+
+    # Transities (aangeroepen vanuit de gui thread)
+    def start(self):
+        with self._condition:
+            self._listening = True
+            self._calibrated = False # Kalibreer opnieuw bij elke start
+            self._error_count = 0
+            self._condition.notify_all()
+
+    def stop(self):
+        with self._condition:
+            self._listening = False
+            self._condition.notify_all()
+        self.source.buffer.interrupt() # Onderbreek een lopende listen()
+
+    def set_muted(self, muted):
+        with self._condition:
+            self._muted = muted
+            self._condition.notify_all()
+
+        if muted:
+            self.capture.pause() # Stream opschorten i.p.v. pollen
+            self.source.buffer.interrupt()
+        else:
+            self.capture.resume()
+
+    # Zin leverde een geldig commando op: pauzes en lengte meenemen in de geleerde limieten
+    def learn(self, zin_id):
+        stats = self._zin_stats.pop(zin_id, None)
+        if stats and self.endpointer.policy:
+            self.endpointer.policy.record(*stats)
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._listening = False
+            self._condition.notify_all()
+        self.source.buffer.interrupt()
+        self.pool.close()
+
+    def _should_run(self):
+        return self._listening and not self._muted and not self._closed
+
+    def _set_state(self, state, status_text=None):
+        self.state = state
+        if status_text and self.on_status:
+            self.on_status(status_text)
+
+    def _wait_until_active(self): # Blokkeert zonder CPU tot er geluisterd mag worden
+        with self._condition:
+            while not self._closed and not self._should_run():
+                self.state = SpraakListener.MUTED if self._muted and self._listening else SpraakListener.IDLE
+                self._condition.wait()
+            return not self._closed
+
+    def _on_result(self, zin_id, tekst, fout): # Resultaat uit de pool (in volgorde van inspreken)
+        if fout is None:
+            self._error_count = 0  # Reset error counter
+            get_latency_tracer().stamp(zin_id, "recognize")
+            self.on_text(zin_id, tekst)
+        elif isinstance(fout, sr.UnknownValueError): # Onbekende spraak
+            if self.on_status:
+                self.on_status("Kon het commando niet begrijpen")
+        else:
+            prefix = "Service fout" if isinstance(fout, sr.RequestError) else "Fout"
+            self._on_error(f"{prefix}: {fout}")
+
+    def _on_error(self, melding):
+        self._error_count += 1
+        if self.on_status:
+            self.on_status(melding)
+
+        if self._error_count >= SpraakListener.MAX_ERRORS:
+            with self._condition:
+                was_listening = self._listening
+                self._listening = False
+            if was_listening and self.on_stopped:
+                self.on_stopped()
+
+    # Decodeer tijdens het inspreken en meld tussentijdse tekst
+    # Geeft de afronding van de zin terug voor de pool (of None zonder audio)
+    def _listen_streaming(self, invoer):
+        stream = None
+        vorige = ""
+        for stuk in self.endpointer.segment(invoer):
+            if stream is None:
+                stream = self.backend.start_stream(invoer.SAMPLE_RATE)
+            
+            partial = stream.feed(stuk)
+            if partial and partial != vorige: # Enkel bij nieuwe tekst
+                if self.on_partial:
+                    self.on_partial(self._zin_id, partial)
+                if self.is_complete and self.is_complete(partial):
+                    self.endpointer.finish_early() # Niet de volle pauze afwachten
+            vorige = partial
+        return stream.finish if stream else None
+
+    def _run(self):
+        while self._wait_until_active():
+            # Eén sessie zolang er geluisterd wordt, de stream blijft open tussen zinnen
+            with self.source as invoer:
+                while True:
+                    # Eerst de onderbreking wissen, dan pas de toestand bekijken:
+                    # een mute/stop daarna zet de vlag opnieuw en wordt dus niet gemist
+                    self.source.buffer.clear_interrupt()
+                    if not self._should_run():
+                        break
+                    try:
+                        # Kalibreer alleen de eerste keer na starten
+                        if not self._calibrated:
+                            self._set_state(SpraakListener.CALIBRATING, "🎧 Kalibreren...")
+                            try:
+                                self.endpointer.calibrate(invoer, duration=1)
+                            except Exception as e:
+                                pass
+                            self._calibrated = True
+
+                        self._set_state(SpraakListener.LISTENING, "🎤 Luisteren...")
+                        context = self.context
+                        self.endpointer.prepare(context)
+                        if self.streaming:
+                            herken = self._listen_streaming(invoer)
+                        else:
+                            audio = self.endpointer.listen(invoer)
+                            herken = (lambda a=audio: self.backend.recognize(a)) if audio.frame_data else None
+                        if herken is None: # Gepauzeerd of onderbroken
+                            continue
+                        get_latency_tracer().begin(self._zin_id, LatencyTracer.nu() - self.endpointer.laatste_stilte)
+                        
+                        # Statistieken bewaren tot de gui weet of het een commando was
+                        for oud in [z for z in list(self._zin_stats) if z < self._zin_id - 20]:
+                            self._zin_stats.pop(oud, None)
+                        self._zin_stats[self._zin_id] = (context, self.endpointer.laatste_pauze, self.endpointer.laatste_duur)
+
+                        # Herkenning (of de afronding ervan) gebeurt in de pool, meteen verder luisteren
+                        if not self.pool.submit(herken, self._zin_id, timeout=0):
+                            # Queue vol: wacht kort op de workers (backpressure)
+                            self._set_state(SpraakListener.RECOGNIZING, "⏳ Herkennen...")
+                            if not self.pool.submit(herken, self._zin_id, timeout=5):
+                                self._on_error("Herkenning te traag, commando overgeslagen")
+                        self._zin_id += 1
+
+                    except sr.WaitTimeoutError: # Timeout bij luisteren
+                        continue
+                    except Exception as e: # Algemene fout
+                        self._on_error(f"Fout: {e}")
 
 # ============================================================================
 # GUI - Main Application
@@ -370,23 +2862,59 @@ class SpraakennennerGUI:
         self.root.title("AI Spraakbesturing")
         self.root.geometry(f"{self.style.WINDOW_WIDTH}x{self.style.WINDOW_HEIGHT}")
         self.root.configure(bg=self.style.BG_PRIMARY)
+        self.config = load_spraak_config()
         
         self.mode = tk.StringVar(value="PC") # Standaard modus is PC
         self.selected_mic = tk.StringVar()
-        self.is_listening = False
         self.is_muted = False
-        self.audio_queue = queue.Queue(maxsize=100) # Queue voor audio niveaus
+        self.capture = AudioCapture() # Gedeelde capture voor visualizer en herkenning
+        self.level_meter = LevelMeter() # Audio niveaus voor de visualizer (lock-free)
+        self.capture.add_consumer(self.level_meter)
+        self.speech_source = CaptureSource(self.capture) # Blijvende spraakbron met pre-roll
+        self.listener = SpraakListener(
+            self.capture,
+            self.speech_source,
+            create_recognizer_backend(self.config["recognizer"], get_commando_manager().grammar),
+            AudioProcessor.configure_endpointer(self.config["vad"], AudioCapture.SAMPLE_RATE),
+            on_text=lambda zin_id, t: self._call_in_gui(self.process_command, t, zin_id),
+            on_partial=lambda zin_id, t: self._call_in_gui(self.process_partial, zin_id, t),
+            on_status=lambda t: self._call_in_gui(lambda: self.status_label.config(text=t)),
+            on_stopped=lambda: self._call_in_gui(self.stop_listening),
+            workers=self.config["recognizer"]["workers"],
+            max_pending=self.config["recognizer"]["max_pending"],
+            streaming=self.config["recognizer"]["streaming"],
+            is_complete=self._is_complete_command
+        )
         self.uitgevoerde_commandos = []
+        self.vroeg_uitgevoerd = {} # zin_id -> commando al uitgevoerd op tussentijdse tekst
         self.current_led_status = "Uit" # Huidige LED status
         self.mqtt_status = "Connecting..." # Huidige MQTT status
         
         self.setup_ui()
+        self._update_listener_context()
         
         # MQTT ontvangen berichten callback
         mqtt_client = get_mqtt_client()
-        mqtt_client.status_callback = self.update_mqtt_status
+        mqtt_client.set_status_callback(self.update_mqtt_status) # Meldt meteen de huidige status
         mqtt_client.set_message_callback(self.update_led_status_from_mqtt)
         
+        # Resultaat van gestarte PC acties (komt van de executor thread)
+        get_command_executor().result_callback = lambda actie, ok, melding: self._call_in_gui(
+            self._on_action_result, actie, ok, melding
+        )
+        
+        # Commando's en MQTT instellingen live herladen bij wijziging
+        self.config_watcher = ConfigWatcher()
+        self.config_watcher.watch(CommandoManager.BESTANDEN, self._reload_commandos)
+        self.config_watcher.watch(("mqtt_config.json",), mqtt_client.reload_config)
+        self.config_watcher.start()
+        
+        # Visualizer stilleggen als het venster niet zichtbaar is
+        self.viz_after_id = None
+        self.viz_activity = time.monotonic() # Laatste keer dat er iets te tonen was
+        self.root.bind("<Map>", self._on_window_map, add="+")
+        self.root.bind("<Unmap>", self._on_window_map, add="+")
+        
         # Audio visualizer starten
         self.start_audio_monitor()
     
@@ -553,11 +3081,9 @@ class SpraakennennerGUI:
             try:
                 idx = int(selection.split(':')[0])
                 self.current_mic_index = idx
+                self._update_listener_context()
                 
                 # Herstart audio stream met nieuwe microfoon
-                if hasattr(self, 'stream'):
-                    self.stream.stop()
-                    self.stream.close()
                 self.start_audio_monitor()
                 
                 self.status_label.config(text=f"Microfoon gewijzigd: {selection}")
@@ -638,14 +3164,14 @@ class SpraakennennerGUI:
         viz_frame = tk.Frame(self.root, bg=self.style.BG_PRIMARY)
         viz_frame.pack(pady=30)
         
-        viz_label = tk.Label(
+        self.viz_label = tk.Label(
             viz_frame,
             text="Audio Niveau:",
             font=self.style.FONT_BODY,
             bg=self.style.BG_PRIMARY,
             fg=self.style.TEXT_PRIMARY
         )
-        viz_label.pack()
+        self.viz_label.pack()
         
         # Canvas voor audio bars
         self.canvas = tk.Canvas(
@@ -659,6 +3185,8 @@ class SpraakennennerGUI:
         
         # Maak audio bars
         self.bars = []
+        self.bar_x = [] # Vaste x posities, niet telkens opvragen bij Tk
+        self.bar_state = [] # Laatst getekende (hoogte, kleur) per bar
         self.bar_count = self.style.BAR_COUNT
         
         for i in range(self.bar_count):
@@ -670,6 +3198,24 @@ class SpraakennennerGUI:
                 outline=""
             )
             self.bars.append(bar)
+            self.bar_x.append(x)
+            self.bar_state.append((0, self.style.GRAY))
+        
+        # Spectrum of volume weergave, klik op de bars om te wisselen
+        viz_config = self.config["visualizer"]
+        self.viz_mode = viz_config["mode"]
+        self.spectrum = SpectrumAnalyzer(self.bar_count, viz_config["min_db"], viz_config["max_db"])
+        self.bar_heights = np.zeros(self.bar_count)
+        self._bar_start = 0 # Eerste bar bij de volgende update (voor het frame budget)
+        self.canvas.bind("<Button-1>", lambda e: self.toggle_viz_mode())
+        self._update_viz_label()
+    
+    def toggle_viz_mode(self):
+        self.viz_mode = "level" if self.viz_mode == "spectrum" else "spectrum"
+        self._update_viz_label()
+    
+    def _update_viz_label(self):
+        self.viz_label.config(text="Spectrum:" if self.viz_mode == "spectrum" else "Audio Niveau:")
     
     def _create_control_buttons(self): # Start/Stop knoppen
         control_frame = tk.Frame(self.root, bg=self.style.BG_PRIMARY)
@@ -718,6 +3264,8 @@ class SpraakennennerGUI:
     
     def toggle_mute(self): # Mute/unmute microfoon
         self.is_muted = not self.is_muted
+        self.listener.set_muted(self.is_muted) # Pauzeert ook de capture stream
+        self._resume_visualizer()
         
         if self.is_muted:
             self.mute_canvas.itemconfig(self.mute_line, state="normal")
@@ -727,9 +3275,6 @@ class SpraakennennerGUI:
                 outline=self.style.RED
             )
             self.status_label.config(text="🔇 Microfoon gedempt")
-            
-            if hasattr(self, 'stream') and self.stream.active:
-                self.stream.stop()
         else:
             self.mute_canvas.itemconfig(self.mute_line, state="hidden")
             self.mute_canvas.itemconfig(
@@ -738,9 +3283,6 @@ class SpraakennennerGUI:
                 outline=self.style.TEXT_PRIMARY
             )
             self.status_label.config(text="🔊 Microfoon actief")
-            
-            if hasattr(self, 'stream') and not self.stream.active:
-                self.stream.start()
     
     def set_mode(self, mode): # Wijzig modus tussen PC en LED
         self.mode.set(mode)
@@ -754,8 +3296,18 @@ class SpraakennennerGUI:
             self.led_button.configure(bg=self.style.BLUE, relief=tk.RAISED)
             self.led_status_frame.pack(pady=10, before=self.canvas.master)
             
+        self._update_listener_context()
         self.status_label.config(text=f"Modus gewijzigd naar: {mode}")
     
+    # Pauzes en zinslengtes worden per microfoon (spreker) en modus (catalogus) geleerd
+    def _update_listener_context(self):
+        self.listener.context = (getattr(self, 'current_mic_index', None), self.mode.get())
+    
+    # Aangeroepen vanuit de listener thread, leest daarom niet de Tk variabele
+    def _is_complete_command(self, tekst):
+        context = self.listener.context
+        return context is not None and get_commando_manager().is_complete_command(tekst, context[1])
+    
     # ------------------------------------------------------------------------
     # Audio Processing
     # ------------------------------------------------------------------------
@@ -783,57 +3335,20 @@ class SpraakennennerGUI:
     # Audio Processing
     # ------------------------------------------------------------------------
     
-    # Audio stream voor visualizer bars
+    # (Her)start de gedeelde capture, de visualizer leest de niveaus uit self.level_meter
     def start_audio_monitor(self):
-        def audio_callback(indata, frames, time, status):
-            if status:
-                print(f"Audio stream status: {status}")
-            
-            try:
-                # Bereken RMS volume en versterk het signaal
-                volume_norm = np.linalg.norm(indata) * 15
-                
-                # Voeg toe aan queue, skip als vol
-                try:
-                    self.audio_queue.put_nowait(volume_norm)
-                except queue.Full:
-                    # Queue is vol, skip dit sample
-                    pass
-                
-                # Update audio info indicator (green bij geluid)
-                if volume_norm > 5:
-                    self.root.after(0, lambda: self.audio_info_label.config(
-                        text="🔊", fg=self.style.GREEN
-                    ))
-                else:
-                    if hasattr(self, 'root') and hasattr(self, 'audio_info_label'):
-                        try:
-                            self.root.after(0, lambda: self.audio_info_label.config(
-                                text="🎤", fg=self.style.GRAY
-                            ))
-                        except:
-                            pass
-            except Exception as e:
-                print(f"Audio callback error: {e}")
-        
         try:
             device_index = self.current_mic_index if hasattr(self, 'current_mic_index') else None
             print(f"Starting audio monitor met device index: {device_index}...")
             
-            # Probeer stream te starten
-            self.stream = sd.InputStream(
-                callback=audio_callback,
-                channels=1,
-                device=device_index,
-                samplerate=44100,
-                blocksize=2048
-            )
-            self.stream.start()
+            self.capture.start(device_index)
+            if getattr(self, 'is_muted', False): # Nieuwe stream blijft opgeschort zolang gemute
+                self.capture.pause()
             
             # Haal device info op
             device_info = sd.query_devices(device_index, 'input')
             print(f"Audio stream actief op: {device_info['name']}")
-            print(f"  Sample rate: {device_info['default_samplerate']} Hz")
+            print(f"  Sample rate: {self.capture.rate} Hz (herkenning: {AudioCapture.SAMPLE_RATE} Hz)")
             print(f"  Channels: {device_info['max_input_channels']}")
             
             # Start audio bars update loop (alleen als nog niet actief)
@@ -856,143 +3371,165 @@ class SpraakennennerGUI:
             if not hasattr(self, 'last_volume'):
                 self.last_volume = 0
             
-            # Haal audio data op uit queue
+            # Laatste niveau uit de meter (enkel als er een nieuw blok binnenkwam)
             current_volume = self.last_volume * 0.7  # Decay voor smooth animatie
-            audio_detected = False
-            
-            queue_items = 0
-            while not self.audio_queue.empty():
-                volume = self.audio_queue.get()
-                queue_items += 1
-                if self.is_muted:
-                    volume = 0
+            rms, piek, blokken = self.level_meter.read()
+            if blokken != getattr(self, 'last_level_blokken', -1):
+                self.last_level_blokken = blokken
+                volume = 0 if self.is_muted else rms * 680 # Versterk het signaal
                 current_volume = max(current_volume, volume)
-                if volume > 5:
-                    audio_detected = True
+                
+                # Audio info indicator (groen bij geluid), enkel bij een wijziging
+                audio_detected = volume > 5
+                if audio_detected != getattr(self, 'audio_detected', None):
+                    self.audio_detected = audio_detected
+                    self.audio_info_label.config(
+                        text="🔊" if audio_detected else "🎤",
+                        fg=self.style.GREEN if audio_detected else self.style.GRAY
+                    )
             
             self.last_volume = current_volume
             
-            # Update alle bars
-            for i, bar in enumerate(self.bars):
+            if self.viz_mode == "spectrum":
+                # Banden uit de laatste samples, zelfde decay als de volume weergave
+                niveaus = 0 if self.is_muted else self.spectrum.process(self.level_meter.window(), self.capture.rate)
+                self.bar_heights = np.maximum(self.bar_heights * 0.7, 10 + niveaus * 120)
+            else:
                 # Creëer golf effect vanuit midden
-                offset = abs(i - self.bar_count / 2)
+                offset = np.abs(np.arange(self.bar_count) - self.bar_count / 2)
                 height_factor = 1 - (offset / self.bar_count)
-                height = max(10, min(130, current_volume * height_factor))
-                
-                # Kleur gradient gebaseerd op hoogte
-                if height < 40:
-                    color = self.style.GRAY
-                elif height < 80:
-                    color = self.style.BLUE
-                else:
-                    color = self.style.GREEN
-                
-                # Update bar positie en kleur
-                coords = self.canvas.coords(bar)
-                if coords:
-                    self.canvas.coords(bar, coords[0], 140 - height, coords[2], 140)
-                    self.canvas.itemconfig(bar, fill=color)
+                self.bar_heights = np.clip(current_volume * height_factor, 10, 130)
+            
+            # Geluid sinds de vorige tick (ook als het tussen twee trage ticks viel)
+            luid = self.level_meter.loud_blocks()
+            if self._draw_bars() or current_volume > 5 or luid != getattr(self, 'last_loud_blocks', luid):
+                self.viz_activity = time.monotonic()
+            self.last_loud_blocks = luid
         except Exception as e:
             pass
         
-        # Schedule volgende update
-        if self.audio_bars_running:
-            self.root.after(50, self.update_audio_bars)
+        # Schedule volgende update, niet als het venster geminimaliseerd of verborgen is
+        self.viz_after_id = None
+        if not self.audio_bars_running or not self._window_visible():
+            return # <Map> start de updates opnieuw
+        
+        viz_config = self.config["visualizer"]
+        delay = viz_config["frame_ms"]
+        if time.monotonic() - self.viz_activity > viz_config["idle_after_s"]:
+            # Stilte: traag updaten, de volgende tick ziet geluid aan de teller van de meter
+            # (geen Tk aanroepen vanuit de audio thread)
+            delay = viz_config["idle_frame_ms"]
+        self.viz_after_id = self.root.after(delay, self.update_audio_bars)
+    
+    def _window_visible(self):
+        try:
+            return self.root.state() not in ("iconic", "withdrawn")
+        except Exception as e:
+            return False
+    
+    def _on_window_map(self, event):
+        if event.widget is self.root: # <Map>/<Unmap> komt ook van alle child widgets
+            self._resume_visualizer()
+    
+    # Meteen een update (op normale snelheid) als er geen loopt of die traag staat
+    def _resume_visualizer(self):
+        self.viz_activity = time.monotonic()
+        if not getattr(self, 'audio_bars_running', False) or not self._window_visible():
+            return
+        if self.viz_after_id is not None:
+            self.root.after_cancel(self.viz_after_id)
+        self.viz_after_id = self.root.after(0, self.update_audio_bars)
+    
+    # Enkel bars waarvan hoogte of kleur veranderde, binnen het frame budget
+    # Wat niet meer past komt de volgende update eerst aan de beurt. Geeft True als er iets bewoog.
+    def _draw_bars(self):
+        budget = self.config["visualizer"]["budget_ms"] / 1000.0
+        begin = time.perf_counter()
+        getekend = False
+        for stap in range(self.bar_count):
+            i = (self._bar_start + stap) % self.bar_count
+            height = int(self.bar_heights[i])
+            
+            # Kleur gradient gebaseerd op hoogte
+            if height < 40:
+                color = self.style.GRAY
+            elif height < 80:
+                color = self.style.BLUE
+            else:
+                color = self.style.GREEN
+            
+            vorige_height, vorige_color = self.bar_state[i]
+            if height == vorige_height and color == vorige_color:
+                continue
+            
+            if time.perf_counter() - begin > budget:
+                self._bar_start = i
+                return True
+            
+            # Update bar positie en kleur
+            x = self.bar_x[i]
+            if height != vorige_height:
+                self.canvas.coords(self.bars[i], x, 140 - height, x + self.style.BAR_WIDTH, 140)
+            if color != vorige_color:
+                self.canvas.itemconfig(self.bars[i], fill=color)
+            self.bar_state[i] = (height, color)
+            getekend = True
+        self._bar_start = 0
+        return getekend
     
     # ------------------------------------------------------------------------
     # Speech Recognition
     # ------------------------------------------------------------------------
     
     def start_listening(self): # Start spraakherkenning
-        self.is_listening = True
         self.start_button.config(state=tk.DISABLED)
         self.stop_button.config(state=tk.NORMAL)
         self.status_label.config(text="🎤 Luisteren... Zeg een commando!")
         
-        threading.Thread(target=self.listen_loop, daemon=True).start()
+        self.listener.start() # Altijd dezelfde listener thread, nooit een tweede loop
     
     def stop_listening(self): # Stop spraakherkenning
-        self.is_listening = False
+        self.listener.stop()
         self.start_button.config(state=tk.NORMAL)
         self.stop_button.config(state=tk.DISABLED)
         self.status_label.config(text="Gestopt")
         self.save_commandos()
     
-    # Spraakherkenning loop (draait in aparte thread)
-    def listen_loop(self):
-        herkenner = AudioProcessor.configure_recognizer()
+    def _reload_commandos(self): # Draait in de ConfigWatcher thread
+        if get_commando_manager().reload_if_changed():
+            self._call_in_gui(lambda: self.status_label.config(text="🔄 Commando's herladen"))
+    
+    def _call_in_gui(self, func, *args): # Voer uit op de Tk thread (vanuit worker threads)
+        try:
+            self.root.after(0, lambda: func(*args))
+        except Exception as e:
+            pass
+    
+    # Tussentijdse tekst: voer een eenduidig commando meteen uit (max 1x per zin)
+    def process_partial(self, zin_id, tekst):
+        if not tekst or not isinstance(tekst, str) or zin_id in self.vroeg_uitgevoerd:
+            return
         
-        # Kalibreer één keer bij starten
-        calibrated = False
-        error_count = 0
-        max_errors = 5
+        tekst_lower = tekst.lower()
+        manager = get_commando_manager()
+        if self.mode.get() == "PC":
+            commando = manager.get_unambiguous_pc_commando(tekst_lower)
+        else:
+            commando = manager.get_unambiguous_led_commando(tekst_lower)
+        if commando is None:
+            return
         
-        while self.is_listening:
-            if self.is_muted:
-                continue
-            
-            try:
-                with sr.Microphone(device_index=self.current_mic_index) as invoer:
-                    # Kalibreer alleen de eerste keer
-                    if not calibrated:
-                        try:
-                            self.root.after(0, lambda: self.status_label.config(text="🎧 Kalibreren..."))
-                            herkenner.adjust_for_ambient_noise(invoer, duration=1)
-                            calibrated = True
-                        except Exception as e:
-                            calibrated = True
-                    
-                    try:
-                        self.root.after(0, lambda: self.status_label.config(text="🎤 Luisteren..."))
-                    except:
-                        pass
-                        
-                    audio = herkenner.listen(invoer, timeout=3, phrase_time_limit=5)
-                    
-                    try:
-                        tekst = herkenner.recognize_google(audio, language="nl-NL")
-                        error_count = 0  # Reset error counter
-                        try:
-                            self.root.after(0, lambda t=tekst: self.process_command(t))
-                        except:
-                            pass
-                    except sr.UnknownValueError: # Onbekende spraak
-                        try:
-                            self.root.after(0, lambda: self.status_label.config(
-                                text="Kon het commando niet begrijpen"
-                            ))
-                        except:
-                            pass
-                    except sr.RequestError as e: # Service fout
-                        error_count += 1
-                        try:
-                            self.root.after(0, lambda err=str(e): self.status_label.config(
-                                text=f"Service fout: {err}"
-                            ))
-                        except:
-                            pass
-                        if error_count >= max_errors:
-                            break
-                            
-            except sr.WaitTimeoutError: # Timeout bij luisteren
-                continue
-            except Exception as e: # Algemene fout
-                error_count += 1
-                try:
-                    self.root.after(0, lambda err=str(e): self.status_label.config(text=f"Fout: {err}"))
-                except:
-                    pass
-                if error_count >= max_errors:
-                    break
+        # Onthoud per zin wat al uitgevoerd is (oude zinnen opruimen)
+        for oud in [z for z in self.vroeg_uitgevoerd if z < zin_id - 10]:
+            del self.vroeg_uitgevoerd[oud]
+        self.vroeg_uitgevoerd[zin_id] = commando
         
-        # Cleanup
-        if error_count >= max_errors:
-            try:
-                self.root.after(0, lambda: self.stop_listening())
-            except:
-                pass
+        if self.mode.get() == "PC":
+            self._process_pc_command(tekst, tekst_lower, commando=commando, zin_id=zin_id)
+        else:
+            self._process_led_command(tekst, tekst_lower, commando=commando, zin_id=zin_id)
     
-    def process_command(self, tekst): # Verwerk herkend commando
+    def process_command(self, tekst, zin_id=None): # Verwerk herkend commando
         if not tekst or not isinstance(tekst, str):
             return
             
@@ -1007,31 +3544,54 @@ class SpraakennennerGUI:
             self.stop_listening() # Stop commando
             return
         
+        # Commando dat al op tussentijdse tekst van deze zin uitgevoerd werd
+        vroeg = self.vroeg_uitgevoerd.pop(zin_id, None) if zin_id is not None else None
+        
         if self.mode.get() == "PC": # PC modus
-            self._process_pc_command(tekst, tekst_lower)
+            herkend = self._process_pc_command(tekst, tekst_lower, vroeg=vroeg, zin_id=zin_id)
         else:
-            self._process_led_command(tekst, tekst_lower)
+            herkend = self._process_led_command(tekst, tekst_lower, vroeg=vroeg, zin_id=zin_id)
+        
+        if herkend and zin_id is not None:
+            self.listener.learn(zin_id) # Endpointer leert van geldige commando's
     
-    def _process_pc_command(self, tekst, tekst_lower): # Verwerk PC commando
-        commando = parse_Commando(tekst_lower)
+    # commando: al gekozen (tussentijdse tekst), vroeg: al uitgevoerd voor deze zin, zin_id: trace id
+    def _process_pc_command(self, tekst, tekst_lower, commando=None, vroeg=None, zin_id=None): # Verwerk PC commando
+        if commando is None:
+            commando = parse_Commando(tekst_lower)
+        get_latency_tracer().stamp(zin_id, "parse")
+        if vroeg is not None and (commando is None or commando is vroeg):
+            return True # Niet twee keer uitvoeren
+        
         if commando:
             commando.uitvoering()
             self.uitgevoerde_commandos.append((datetime.datetime.now(), tekst))
             self.status_label.config(text=f'✓ Commando uitgevoerd: "{tekst}"')
-        else:
-            self.status_label.config(text="Geen geldig commando herkend")
+            return True
+        self.status_label.config(text="Geen geldig commando herkend")
+        return False
     
-    def _process_led_command(self, tekst, tekst_lower): # Verwerk LED commando
-        led_commando = parse_Led_Commando(tekst_lower)
+    def _process_led_command(self, tekst, tekst_lower, commando=None, vroeg=None, zin_id=None): # Verwerk LED commando
+        led_commando = commando if commando is not None else parse_Led_Commando(tekst_lower)
+        tracer = get_latency_tracer()
+        tracer.stamp(zin_id, "parse")
+        if vroeg is not None and (led_commando is None or led_commando is vroeg):
+            return True # Niet twee keer uitvoeren
+        
         if led_commando:
+            tracer.expect(led_commando.actie, zin_id) # publish, PUBACK en state volgen in de mqtt client
             led_commando.uitvoering()
             self.uitgevoerde_commandos.append((datetime.datetime.now(), f"LED: {tekst}"))
             
-            # Update LED status
-            self._update_led_status_display(tekst_lower)
+            # LED status volgt enkel uit wat de controller meldt (state topic)
             self.status_label.config(text=f'✓ LED Commando uitgevoerd: "{tekst}"')
-        else:
-            self.status_label.config(text="Geen geldig LED commando herkend")
+            return True
+        self.status_label.config(text="Geen geldig LED commando herkend")
+        return False
+    
+    def _on_action_result(self, actie, ok, melding): # Enkel fouten tonen, succes is al gemeld
+        if not ok:
+            self.status_label.config(text=f"✗ Actie '{actie}' mislukt: {melding}")
     
     def _update_led_status_display(self, command_text): # Update LED status label
         status_map = {
@@ -1057,7 +3617,7 @@ class SpraakennennerGUI:
         if self.led_status_frame.winfo_ismapped():
             self.led_status_label.config(text=self.current_led_status)
     
-    def update_led_status_from_mqtt(self, command): # Update LED status van MQTT bericht
+    def update_led_status_from_mqtt(self, command): # Update LED status met de toestand van de controller
         if not command or not isinstance(command, str):
             return
         
@@ -1068,7 +3628,7 @@ class SpraakennennerGUI:
                 
                 # Update status label
                 self.status_label.config(
-                    text=f'MQTT ontvangen: "{command}"'
+                    text=f'LED controller: "{command}"'
                 )
             except Exception as e:
                 pass
@@ -1091,17 +3651,19 @@ class SpraakennennerGUI:
     
     # Cleanup bij afsluiten applicatie
     def on_closing(self):
-        self.is_listening = False
+        self.listener.close()
+        self.config_watcher.stop()
+        get_command_executor().close()
         self.audio_bars_running = False
         
-        if hasattr(self, 'stream'):
-            try:
-                self.stream.stop()
-                self.stream.close()
-            except Exception as e:
-                pass
+        export_file = load_spraak_config()["tracing"]["export_file"]
+        if export_file:
+            get_latency_tracer().export(export_file) # Vertraging per stap (p50/p95/p99)
+        
+        self.capture.close()
         
         try:
+            get_led_publisher().close() # Laatste samengevoegde commando's nog versturen
             mqtt_client = get_mqtt_client()
             mqtt_client.disconnect()
         except Exception as e:
@@ -1159,5 +3721,63 @@ def main():
             _window_running = False
             _pending_runs = 0
 
+# Benchmark van het pad tekst -> LedCommando -> MQTT -> toestand van de controller
+# Volledig in-process via de loopback broker (geen broker, microfoon of GUI nodig),
+# gemeten met de LatencyTracer (parse, publish, puback, state)
+# latency_ms: vertraging per aflevering, onderbreken: verbinding verbreken na elke N commando's
+def benchmark_led_pad(aantal=200, latency_ms=0.0, onderbreken=0):
+    broker = get_loopback_broker()
+    broker.latency = latency_ms / 1000.0
+    config = load_mqtt_config()
+    broker.add_controller(config["command_topic"], config["state_topic"])
+    
+    client = MqttClient(broker=LOOPBACK_BROKER)
+    toestand = queue.Queue()
+    client.set_message_callback(toestand.put)
+    einde = time.monotonic() + 5.0
+    while not client.connected and time.monotonic() < einde:
+        time.sleep(0.01)
+    if not client.connected:
+        print("Benchmark: geen verbinding met de loopback broker")
+        return None
+    tracer = get_latency_tracer()
+    manager = CommandoManager(mqtt_client=client) # Zonder LedPublisher: elk commando meteen verstuurd
+    zinnen = list(manager.led_commandos.keys())
+    if not zinnen:
+        print("Benchmark: geen LED commando's gevonden")
+        return None
+    
+    verloren = 0
+    start = time.perf_counter()
+    for i in range(aantal):
+        if onderbreken and i and i % onderbreken == 0:
+            broker.disconnect_all()
+        
+        while not toestand.empty(): # Retained toestand (ook na een reconnect) telt niet mee
+            toestand.get_nowait()
+        
+        tracer.begin(i) # Trace zonder spraak: parse telt vanaf hier
+        commando = manager.get_led_commando(zinnen[i % len(zinnen)])
+        tracer.stamp(i, "parse")
+        tracer.expect(commando.actie, i)
+        commando.uitvoering()
+        try: # Wachten op de toestand die de controller voor dit commando meldt
+            while toestand.get(timeout=2.0) != commando.actie:
+                pass
+        except queue.Empty:
+            verloren += 1
+    duur = time.perf_counter() - start
+    time.sleep(2 * broker.latency + 0.05) # Laatste PUBACK
+    client.disconnect()
+    
+    resultaat = {"aantal": aantal, "verloren": verloren, "per_seconde": round(aantal / duur, 1)}
+    resultaat.update(tracer.report())
+    print(json.dumps(resultaat, indent=2))
+    return resultaat
+
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    if "--benchmark" in sys.argv: # python spraak.py --benchmark [aantal] [latency_ms] [onderbreken]
+        argumenten = sys.argv[sys.argv.index("--benchmark") + 1:]
+        benchmark_led_pad(*[float(a) if "." in a else int(a) for a in argumenten[:3]])
+    else:
+        main() 
\ No newline at end of file